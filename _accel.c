@@ -0,0 +1,767 @@
+/*
+ * Compiled versions of the hot parts of solitaire.py, loaded by accel.py
+ * with ctypes. Nothing here is needed: if it can't be built, everything
+ * runs in Python instead.
+ *
+ * States come in as GameState.pack() bytes, and moves go in and out as 4
+ * bytes each: a type (see MOVE_* below) and up to three numbers, the same
+ * arguments as the Move classes take. Everything is done the same way, in
+ * the same order, as the Python version, so that a search here finds
+ * exactly the same solution as DepthFirstSearch with the default move
+ * ordering and a new transposition table.
+ */
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define MAX_CARDS 52
+#define MAX_MOVES 512
+#define MAX_KEY 80
+
+#define RANK(card) ((card) % 13)
+#define SUIT(card) ((card) / 13)
+
+enum {
+    MOVE_TURN_STOCK,
+    MOVE_TABLEAU_TO_TABLEAU,
+    MOVE_TABLEAU_TO_FOUNDATION,
+    MOVE_WASTE_TO_TABLEAU,
+    MOVE_WASTE_TO_FOUNDATION,
+    MOVE_FOUNDATION_TO_TABLEAU
+};
+
+enum { RUNNING, WON, LOST };
+
+typedef struct {
+    int draw;
+    int redeals;  /* -1 for no limit */
+    int foundation_to_tableau;
+} Rules;
+
+/* Each column is one array: the first down[col] cards are face down, and
+ * the rest up to count[col] are face up. */
+typedef struct {
+    uint8_t foundation[4];
+    uint8_t stock_count, waste_count, redeals;
+    uint8_t stock[MAX_CARDS], waste[MAX_CARDS];
+    uint8_t down[7], count[7];
+    uint8_t columns[7][MAX_CARDS];
+} State;
+
+typedef uint8_t Move[4];
+
+
+/* Packing */
+
+static int unpack(const uint8_t *packed, int length, const Rules *rules,
+                  State *state)
+{
+    int position = 6, total = 0, col, i;
+
+    if (length < 6)
+        return -1;
+    for (i = 0; i < 4; i++) {
+        if (packed[i] > 13)
+            return -1;
+        state->foundation[i] = packed[i];
+    }
+
+    state->stock_count = packed[4];
+    if (state->stock_count > MAX_CARDS || length < 5 + state->stock_count + 1)
+        return -1;
+    memcpy(state->stock, packed + 5, state->stock_count);
+    position = 5 + state->stock_count;
+    state->waste_count = packed[position++];
+    if (state->waste_count > MAX_CARDS
+            || length < position + state->waste_count)
+        return -1;
+    memcpy(state->waste, packed + position, state->waste_count);
+    position += state->waste_count;
+    total = state->stock_count + state->waste_count;
+
+    for (col = 0; col < 7; col++) {
+        int down, up;
+        if (length < position + 2)
+            return -1;
+        down = packed[position];
+        up = packed[position + 1];
+        position += 2;
+        total += down + up;
+        if (total > MAX_CARDS || length < position + down + up)
+            return -1;
+        state->down[col] = down;
+        state->count[col] = down + up;
+        memcpy(state->columns[col], packed + position, down + up);
+        position += down + up;
+    }
+
+    state->redeals = 0;
+    if (rules->redeals >= 0) {
+        if (length < position + 1)
+            return -1;
+        state->redeals = packed[position++];
+    }
+    if (position != length)
+        return -1;
+
+    for (i = 0; i < state->stock_count; i++)
+        if (state->stock[i] >= 52)
+            return -1;
+    for (i = 0; i < state->waste_count; i++)
+        if (state->waste[i] >= 52)
+            return -1;
+    for (col = 0; col < 7; col++)
+        for (i = 0; i < state->count[col]; i++)
+            if (state->columns[col][i] >= 52)
+                return -1;
+    return 0;
+}
+
+static int pack(const State *state, const Rules *rules, uint8_t *packed)
+{
+    int position = 0, col;
+
+    memcpy(packed, state->foundation, 4);
+    position = 4;
+    packed[position++] = state->stock_count;
+    memcpy(packed + position, state->stock, state->stock_count);
+    position += state->stock_count;
+    packed[position++] = state->waste_count;
+    memcpy(packed + position, state->waste, state->waste_count);
+    position += state->waste_count;
+    for (col = 0; col < 7; col++) {
+        packed[position++] = state->down[col];
+        packed[position++] = state->count[col] - state->down[col];
+        memcpy(packed + position, state->columns[col], state->count[col]);
+        position += state->count[col];
+    }
+    if (rules->redeals >= 0)
+        packed[position++] = state->redeals;
+    return position;
+}
+
+/* Is column a less than column b, comparing their bytes in GameState.key()
+ * like Python compares bytes? */
+static int column_less(const State *state, int a, int b)
+{
+    uint8_t bytes_a[MAX_CARDS + 2], bytes_b[MAX_CARDS + 2];
+    int length_a = state->count[a] + 2, length_b = state->count[b] + 2;
+    int length = length_a < length_b ? length_a : length_b;
+    int difference;
+
+    bytes_a[0] = state->down[a];
+    bytes_a[1] = state->count[a] - state->down[a];
+    memcpy(bytes_a + 2, state->columns[a], state->count[a]);
+    bytes_b[0] = state->down[b];
+    bytes_b[1] = state->count[b] - state->down[b];
+    memcpy(bytes_b + 2, state->columns[b], state->count[b]);
+
+    difference = memcmp(bytes_a, bytes_b, length);
+    if (difference != 0)
+        return difference < 0;
+    return length_a < length_b;
+}
+
+/* The same bytes as GameState.key() */
+static int make_key(const State *state, const Rules *rules, uint8_t *key)
+{
+    int order[7], position, i, j;
+
+    for (i = 0; i < 7; i++) {
+        int col = i;
+        for (j = i; j > 0 && column_less(state, col, order[j - 1]); j--)
+            order[j] = order[j - 1];
+        order[j] = col;
+    }
+
+    memcpy(key, state->foundation, 4);
+    position = 4;
+    key[position++] = state->stock_count;
+    memcpy(key + position, state->stock, state->stock_count);
+    position += state->stock_count;
+    key[position++] = state->waste_count;
+    memcpy(key + position, state->waste, state->waste_count);
+    position += state->waste_count;
+    for (i = 0; i < 7; i++) {
+        int col = order[i];
+        key[position++] = state->down[col];
+        key[position++] = state->count[col] - state->down[col];
+        memcpy(key + position, state->columns[col], state->count[col]);
+        position += state->count[col];
+    }
+    if (rules->redeals >= 0)
+        key[position++] = state->redeals;
+    return position;
+}
+
+static int is_won(const State *state)
+{
+    return (state->foundation[0] == 13 && state->foundation[1] == 13
+            && state->foundation[2] == 13 && state->foundation[3] == 13);
+}
+
+
+/* Moves */
+
+static int fits_under(int card, int over)
+{
+    return ((SUIT(card) + SUIT(over)) & 1) && RANK(over) - RANK(card) == 1;
+}
+
+static int face_up_count(const State *state, int col)
+{
+    return state->count[col] - state->down[col];
+}
+
+/* Can card go on top of column target? Like the Python, a column with no
+ * face-up cards counts as empty. */
+static int fits_on(const State *state, int card, int target)
+{
+    if (face_up_count(state, target) == 0)
+        return RANK(card) == 12;
+    return fits_under(card, state->columns[target][state->count[target] - 1]);
+}
+
+static int safe_for_foundation(int card, const uint8_t *foundation)
+{
+    int rank = RANK(card), suit = SUIT(card);
+    if (rank <= 1)
+        return 1;
+    return (foundation[(suit + 1) % 4] >= rank
+            && foundation[(suit + 3) % 4] >= rank
+            && foundation[(suit + 2) % 4] >= rank - 1);
+}
+
+static void set_move(Move move, int type, int a, int b, int c)
+{
+    move[0] = type;
+    move[1] = a;
+    move[2] = b;
+    move[3] = c;
+}
+
+/* GameState.iter_moves(), or pruned_moves() with prune */
+static int generate_moves(const State *state, const Rules *rules, int prune,
+                          Move *moves)
+{
+    const uint8_t *foundation = state->foundation;
+    int count = 0, col, row, target, suit, card;
+
+    if (prune) {
+        for (col = 0; col < 7; col++) {
+            if (face_up_count(state, col) == 0)
+                continue;
+            card = state->columns[col][state->count[col] - 1];
+            if (RANK(card) == foundation[SUIT(card)]
+                    && safe_for_foundation(card, foundation)) {
+                set_move(moves[0], MOVE_TABLEAU_TO_FOUNDATION, col, 0, 0);
+                return 1;
+            }
+        }
+        if (state->waste_count > 0) {
+            card = state->waste[state->waste_count - 1];
+            if (RANK(card) == foundation[SUIT(card)]
+                    && safe_for_foundation(card, foundation)) {
+                set_move(moves[0], MOVE_WASTE_TO_FOUNDATION, 0, 0, 0);
+                return 1;
+            }
+        }
+    }
+
+    for (col = 0; col < 7; col++) {
+        if (face_up_count(state, col) == 0)
+            continue;
+        card = state->columns[col][state->count[col] - 1];
+        if (RANK(card) == foundation[SUIT(card)])
+            set_move(moves[count++], MOVE_TABLEAU_TO_FOUNDATION, col, 0, 0);
+    }
+
+    if (state->waste_count > 0) {
+        card = state->waste[state->waste_count - 1];
+        if (RANK(card) == foundation[SUIT(card)])
+            set_move(moves[count++], MOVE_WASTE_TO_FOUNDATION, 0, 0, 0);
+        for (target = 0; target < 7; target++)
+            if (fits_on(state, card, target))
+                set_move(moves[count++], MOVE_WASTE_TO_TABLEAU, target, 0, 0);
+    }
+
+    for (col = 0; col < 7; col++) {
+        for (row = 0; row < face_up_count(state, col); row++) {
+            card = state->columns[col][state->down[col] + row];
+            for (target = 0; target < 7; target++) {
+                if (target == col || !fits_on(state, card, target))
+                    continue;
+                /* a king with nothing under it going to an empty column */
+                if (prune && row == 0 && state->down[col] == 0
+                        && face_up_count(state, target) == 0)
+                    continue;
+                set_move(moves[count++], MOVE_TABLEAU_TO_TABLEAU, col, row,
+                         target);
+            }
+        }
+    }
+
+    if (state->stock_count > 0 || rules->redeals < 0
+            || (state->waste_count > 0 && state->redeals < rules->redeals))
+        set_move(moves[count++], MOVE_TURN_STOCK, 0, 0, 0);
+
+    if (!rules->foundation_to_tableau)
+        return count;
+    for (suit = 0; suit < 4; suit++) {
+        if (foundation[suit] == 0)
+            continue;
+        card = suit * 13 + foundation[suit] - 1;
+        if (prune && safe_for_foundation(card, foundation))
+            continue;
+        for (target = 0; target < 7; target++)
+            if (fits_on(state, card, target))
+                set_move(moves[count++], MOVE_FOUNDATION_TO_TABLEAU, suit,
+                         target, 0);
+    }
+
+    return count;
+}
+
+/* Take count cards off the top of column col, turning over a face-down
+ * card if that leaves no face-up ones. */
+static void shorten_column(State *state, int col, int count)
+{
+    state->count[col] = count;
+    if (state->count[col] == state->down[col] && state->down[col] > 0)
+        state->down[col]--;
+}
+
+static int apply_move(const State *state, const Rules *rules,
+                      const uint8_t *move, State *new_state)
+{
+    int card, col, row, target, suit, i;
+
+    *new_state = *state;
+    switch (move[0]) {
+    case MOVE_TURN_STOCK:
+        if (state->stock_count == 0) {
+            if (rules->redeals >= 0) {
+                if (state->redeals >= rules->redeals
+                        || state->waste_count == 0)
+                    return -1;
+                new_state->redeals++;
+            }
+            for (i = 0; i < state->waste_count; i++)
+                new_state->stock[i] = state->waste[state->waste_count - 1 - i];
+            new_state->stock_count = state->waste_count;
+            new_state->waste_count = 0;
+        }
+        for (i = 0; i < rules->draw && new_state->stock_count > 0; i++)
+            new_state->waste[new_state->waste_count++]
+                = new_state->stock[--new_state->stock_count];
+        return 0;
+
+    case MOVE_TABLEAU_TO_TABLEAU:
+        col = move[1];
+        row = move[2];
+        target = move[3];
+        if (col >= 7 || target >= 7 || col == target
+                || row >= face_up_count(state, col))
+            return -1;
+        card = state->columns[col][state->down[col] + row];
+        if (!fits_on(state, card, target))
+            return -1;
+        for (i = state->down[col] + row; i < state->count[col]; i++)
+            new_state->columns[target][new_state->count[target]++]
+                = state->columns[col][i];
+        shorten_column(new_state, col, state->down[col] + row);
+        return 0;
+
+    case MOVE_TABLEAU_TO_FOUNDATION:
+        col = move[1];
+        if (col >= 7 || face_up_count(state, col) == 0)
+            return -1;
+        card = state->columns[col][state->count[col] - 1];
+        if (RANK(card) != state->foundation[SUIT(card)])
+            return -1;
+        new_state->foundation[SUIT(card)]++;
+        shorten_column(new_state, col, state->count[col] - 1);
+        return 0;
+
+    case MOVE_WASTE_TO_TABLEAU:
+        target = move[1];
+        if (target >= 7 || state->waste_count == 0)
+            return -1;
+        card = state->waste[state->waste_count - 1];
+        if (!fits_on(state, card, target))
+            return -1;
+        new_state->waste_count--;
+        new_state->columns[target][new_state->count[target]++] = card;
+        return 0;
+
+    case MOVE_WASTE_TO_FOUNDATION:
+        if (state->waste_count == 0)
+            return -1;
+        card = state->waste[state->waste_count - 1];
+        if (RANK(card) != state->foundation[SUIT(card)])
+            return -1;
+        new_state->waste_count--;
+        new_state->foundation[SUIT(card)]++;
+        return 0;
+
+    case MOVE_FOUNDATION_TO_TABLEAU:
+        suit = move[1];
+        target = move[2];
+        if (!rules->foundation_to_tableau || suit >= 4 || target >= 7
+                || state->foundation[suit] == 0)
+            return -1;
+        card = suit * 13 + state->foundation[suit] - 1;
+        if (!fits_on(state, card, target))
+            return -1;
+        new_state->foundation[suit]--;
+        new_state->columns[target][new_state->count[target]++] = card;
+        return 0;
+    }
+    return -1;
+}
+
+
+/* Visited states: an open addressing hash table of keys, which are kept
+ * one after the other in one big array. */
+
+typedef struct {
+    uint64_t *hashes;
+    uint32_t *offsets;  /* into keys, plus one; 0 for an empty slot */
+    size_t capacity, count;
+    uint8_t *keys;
+    size_t keys_used, keys_capacity;
+} Visited;
+
+static uint64_t hash_key(const uint8_t *key, int length)
+{
+    uint64_t hash = 14695981039346656037ULL;
+    int i;
+    for (i = 0; i < length; i++) {
+        hash ^= key[i];
+        hash *= 1099511628211ULL;
+    }
+    return hash;
+}
+
+static int visited_init(Visited *visited)
+{
+    visited->capacity = 1 << 16;
+    visited->count = 0;
+    visited->hashes = calloc(visited->capacity, sizeof(uint64_t));
+    visited->offsets = calloc(visited->capacity, sizeof(uint32_t));
+    visited->keys_capacity = 1 << 20;
+    visited->keys_used = 0;
+    visited->keys = malloc(visited->keys_capacity);
+    if (!visited->hashes || !visited->offsets || !visited->keys)
+        return -1;
+    return 0;
+}
+
+static void visited_free(Visited *visited)
+{
+    free(visited->hashes);
+    free(visited->offsets);
+    free(visited->keys);
+}
+
+static void visited_place(uint64_t *hashes, uint32_t *offsets,
+                          size_t capacity, uint64_t hash, uint32_t offset)
+{
+    size_t slot = hash & (capacity - 1);
+    while (offsets[slot])
+        slot = (slot + 1) & (capacity - 1);
+    hashes[slot] = hash;
+    offsets[slot] = offset;
+}
+
+static int visited_grow(Visited *visited)
+{
+    size_t capacity = visited->capacity * 2, slot;
+    uint64_t *hashes = calloc(capacity, sizeof(uint64_t));
+    uint32_t *offsets = calloc(capacity, sizeof(uint32_t));
+
+    if (!hashes || !offsets) {
+        free(hashes);
+        free(offsets);
+        return -1;
+    }
+    for (slot = 0; slot < visited->capacity; slot++)
+        if (visited->offsets[slot])
+            visited_place(hashes, offsets, capacity, visited->hashes[slot],
+                          visited->offsets[slot]);
+    free(visited->hashes);
+    free(visited->offsets);
+    visited->hashes = hashes;
+    visited->offsets = offsets;
+    visited->capacity = capacity;
+    return 0;
+}
+
+/* Like VisitedSet.visit(): 1 if the key is new (and now added), 0 if it
+ * was already there, -1 if we ran out of memory. */
+static int visit(Visited *visited, const uint8_t *key, int length)
+{
+    uint64_t hash = hash_key(key, length);
+    size_t slot = hash & (visited->capacity - 1);
+
+    while (visited->offsets[slot]) {
+        if (visited->hashes[slot] == hash) {
+            const uint8_t *other = visited->keys + visited->offsets[slot] - 1;
+            if (other[0] == length && memcmp(other + 1, key, length) == 0)
+                return 0;
+        }
+        slot = (slot + 1) & (visited->capacity - 1);
+    }
+
+    if (visited->keys_used + length + 1 > visited->keys_capacity) {
+        size_t capacity = visited->keys_capacity * 2;
+        uint8_t *keys;
+        if (capacity > UINT32_MAX)
+            return -1;
+        keys = realloc(visited->keys, capacity);
+        if (!keys)
+            return -1;
+        visited->keys = keys;
+        visited->keys_capacity = capacity;
+    }
+    visited->keys[visited->keys_used] = length;
+    memcpy(visited->keys + visited->keys_used + 1, key, length);
+    visited->hashes[slot] = hash;
+    visited->offsets[slot] = visited->keys_used + 1;
+    visited->keys_used += length + 1;
+    visited->count++;
+
+    if (visited->count * 2 > visited->capacity && visited_grow(visited))
+        return -1;
+    return 1;
+}
+
+
+/* Depth-first search, the same as DepthFirstSearch.run() */
+
+typedef struct {
+    State state;
+    size_t first_move;
+    int move_count, next_move;
+    Move last_move;
+} Frame;
+
+typedef struct {
+    Rules rules;
+    int prune;
+    Frame *frames;
+    size_t frame_count, frame_capacity;
+    Move *moves;
+    size_t move_count, move_capacity;
+    Visited visited;
+    long nodes, max_depth, expanded, moves_generated;
+    int status;
+    Move *solution;
+    long solution_length;
+} Search;
+
+static int push(Search *search, const State *state)
+{
+    Frame *frame;
+
+    if (search->frame_count == search->frame_capacity) {
+        size_t capacity = search->frame_capacity * 2;
+        Frame *frames = realloc(search->frames, capacity * sizeof(Frame));
+        if (!frames)
+            return -1;
+        search->frames = frames;
+        search->frame_capacity = capacity;
+    }
+    if (search->move_count + MAX_MOVES > search->move_capacity) {
+        size_t capacity = search->move_capacity * 2;
+        Move *moves = realloc(search->moves, capacity * sizeof(Move));
+        if (!moves)
+            return -1;
+        search->moves = moves;
+        search->move_capacity = capacity;
+    }
+
+    frame = &search->frames[search->frame_count++];
+    frame->state = *state;
+    frame->first_move = search->move_count;
+    frame->move_count = generate_moves(
+        state, &search->rules, search->prune,
+        search->moves + search->move_count);
+    frame->next_move = 0;
+    search->move_count += frame->move_count;
+    search->expanded++;
+    if ((long)search->frame_count - 1 > search->max_depth)
+        search->max_depth = search->frame_count - 1;
+    return 0;
+}
+
+static void finish_won(Search *search)
+{
+    size_t i;
+
+    search->solution = malloc((search->frame_count + 1) * sizeof(Move));
+    if (search->solution) {
+        for (i = 0; i < search->frame_count; i++)
+            memcpy(search->solution[i], search->frames[i].last_move,
+                   sizeof(Move));
+        search->solution_length = search->frame_count;
+    }
+    search->status = WON;
+    search->frame_count = 0;
+}
+
+void accel_search_free(Search *search)
+{
+    if (!search)
+        return;
+    free(search->frames);
+    free(search->moves);
+    free(search->solution);
+    visited_free(&search->visited);
+    free(search);
+}
+
+Search *accel_search_new(const uint8_t *packed, int length, int draw,
+                         int redeals, int foundation_to_tableau, int prune)
+{
+    Search *search = calloc(1, sizeof(Search));
+    State state;
+    uint8_t key[MAX_KEY];
+
+    if (!search)
+        return NULL;
+    search->rules.draw = draw;
+    search->rules.redeals = redeals;
+    search->rules.foundation_to_tableau = foundation_to_tableau;
+    search->prune = prune;
+    search->frame_capacity = 256;
+    search->frames = malloc(search->frame_capacity * sizeof(Frame));
+    search->move_capacity = 16 * MAX_MOVES;
+    search->moves = malloc(search->move_capacity * sizeof(Move));
+    if (!search->frames || !search->moves
+            || visited_init(&search->visited)
+            || unpack(packed, length, &search->rules, &state)) {
+        accel_search_free(search);
+        return NULL;
+    }
+
+    visit(&search->visited, key, make_key(&state, &search->rules, key));
+    if (is_won(&state)) {
+        search->status = WON;
+        search->solution = malloc(sizeof(Move));
+        search->solution_length = 0;
+    } else if (push(search, &state)) {
+        accel_search_free(search);
+        return NULL;
+    }
+    return search;
+}
+
+/* Returns 1 when the search is finished, 0 if it stopped after max_nodes
+ * (negative for no limit), and -1 if it ran out of memory. */
+int accel_search_run(Search *search, long max_nodes)
+{
+    long nodes_at_start = search->nodes;
+    uint8_t key[MAX_KEY];
+    State new_state;
+
+    while (search->frame_count > 0) {
+        Frame *frame;
+        const uint8_t *move;
+        int visited;
+
+        if (max_nodes >= 0 && search->nodes - nodes_at_start >= max_nodes)
+            return 0;
+
+        frame = &search->frames[search->frame_count - 1];
+        if (frame->next_move == frame->move_count) {
+            search->move_count = frame->first_move;
+            search->frame_count--;
+            continue;
+        }
+
+        move = search->moves[frame->first_move + frame->next_move++];
+        memcpy(frame->last_move, move, sizeof(Move));
+        search->moves_generated++;
+        if (apply_move(&frame->state, &search->rules, move, &new_state))
+            continue;
+
+        if (is_won(&new_state)) {
+            search->nodes++;
+            finish_won(search);
+            return 1;
+        }
+
+        visited = visit(&search->visited, key,
+                        make_key(&new_state, &search->rules, key));
+        if (visited < 0)
+            return -1;
+        if (!visited)
+            continue;
+
+        search->nodes++;
+        if (push(search, &new_state))
+            return -1;
+    }
+
+    if (search->status == RUNNING)
+        search->status = LOST;
+    return 1;
+}
+
+/* nodes, depth, max_depth, expanded, moves_generated, status and the
+ * length of the solution */
+void accel_search_info(const Search *search, long *info)
+{
+    info[0] = search->nodes;
+    info[1] = search->frame_count > 0 ? search->frame_count - 1 : 0;
+    info[2] = search->max_depth;
+    info[3] = search->expanded;
+    info[4] = search->moves_generated;
+    info[5] = search->status;
+    info[6] = search->solution_length;
+}
+
+void accel_search_solution(const Search *search, uint8_t *moves)
+{
+    memcpy(moves, search->solution, search->solution_length * sizeof(Move));
+}
+
+
+/* The pieces on their own, for checking against the Python */
+
+int accel_moves(const uint8_t *packed, int length, int draw, int redeals,
+                int foundation_to_tableau, int prune, uint8_t *moves)
+{
+    Rules rules = {draw, redeals, foundation_to_tableau};
+    State state;
+
+    if (unpack(packed, length, &rules, &state))
+        return -1;
+    return generate_moves(&state, &rules, prune, (Move *)moves);
+}
+
+int accel_apply(const uint8_t *packed, int length, int draw, int redeals,
+                int foundation_to_tableau, const uint8_t *move,
+                uint8_t *new_packed)
+{
+    Rules rules = {draw, redeals, foundation_to_tableau};
+    State state, new_state;
+
+    if (unpack(packed, length, &rules, &state)
+            || apply_move(&state, &rules, move, &new_state))
+        return -1;
+    return pack(&new_state, &rules, new_packed);
+}
+
+int accel_key(const uint8_t *packed, int length, int draw, int redeals,
+              int foundation_to_tableau, uint8_t *key)
+{
+    Rules rules = {draw, redeals, foundation_to_tableau};
+    State state;
+
+    if (unpack(packed, length, &rules, &state))
+        return -1;
+    return make_key(&state, &rules, key);
+}
@@ -0,0 +1,250 @@
+"""
+Optional compiled version of the depth-first search, for speed.
+
+The first time this is imported it compiles _accel.c with the C compiler
+(cc, or whatever $CC says) into a shared library next to it, or in the
+temporary directory if it can't write there, and loads that with ctypes.
+If there's no compiler, or anything else goes wrong, available is False and
+solve() just carries on in Python. Set $SOLITAIRE_NO_ACCEL to not even try.
+
+The C works on GameState.pack() bytes and does everything the same way as
+the Python, so AcceleratedSearch finds exactly the same solution as
+DepthFirstSearch (with the default move ordering, a new VisitedSet and a new
+TranspositionTable) after visiting exactly the same number of states.
+"""
+
+import ctypes
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+
+from solitaire import (
+    MoveFoundationToTableau, MoveTableauToFoundation, MoveTableauToTableau,
+    MoveWasteToFoundation, MoveWasteToTableau, SearchStats, TurnStock)
+
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_accel.c")
+
+# move types in the C, in order
+_MOVE_TYPES = [
+    TurnStock, MoveTableauToTableau, MoveTableauToFoundation,
+    MoveWasteToTableau, MoveWasteToFoundation, MoveFoundationToTableau]
+
+# states of a search in the C
+_RUNNING, _WON, _LOST = range(3)
+
+_MAX_MOVES = 512
+_MAX_PACKED = 80
+
+
+def _build():
+    """
+    Compile SOURCE if it hasn't been already, and return the path to the
+    library, or None if it can't be built.
+    """
+    with open(SOURCE, "rb") as source_file:
+        digest = hashlib.sha1(source_file.read()).hexdigest()[:12]
+    suffix = ".dll" if sys.platform == "win32" else ".so"
+    name = "_accel-{}{}".format(digest, suffix)
+    compiler = os.environ.get("CC", "cc")
+
+    for directory in [os.path.dirname(SOURCE), tempfile.gettempdir()]:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+
+        # build under another name and rename it, so that another process
+        # never sees half a library
+        partial = "{}.{}".format(path, os.getpid())
+        try:
+            subprocess.run(
+                [compiler, "-O2", "-shared", "-fPIC", "-o", partial, SOURCE],
+                check=True, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+            os.replace(partial, path)
+            return path
+        except (OSError, subprocess.CalledProcessError):
+            if os.path.exists(partial):
+                os.remove(partial)
+    return None
+
+
+def _load():
+    if os.environ.get("SOLITAIRE_NO_ACCEL"):
+        return None
+    try:
+        path = _build()
+        if path is None:
+            return None
+        lib = ctypes.CDLL(path)
+    except OSError:
+        return None
+
+    rules = [ctypes.c_int, ctypes.c_int, ctypes.c_int]
+    lib.accel_search_new.argtypes = (
+        [ctypes.c_char_p, ctypes.c_int] + rules + [ctypes.c_int])
+    lib.accel_search_new.restype = ctypes.c_void_p
+    lib.accel_search_run.argtypes = [ctypes.c_void_p, ctypes.c_long]
+    lib.accel_search_run.restype = ctypes.c_int
+    lib.accel_search_info.argtypes = [
+        ctypes.c_void_p, ctypes.POINTER(ctypes.c_long)]
+    lib.accel_search_info.restype = None
+    lib.accel_search_solution.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    lib.accel_search_solution.restype = None
+    lib.accel_search_free.argtypes = [ctypes.c_void_p]
+    lib.accel_search_free.restype = None
+    lib.accel_moves.argtypes = (
+        [ctypes.c_char_p, ctypes.c_int] + rules
+        + [ctypes.c_int, ctypes.c_char_p])
+    lib.accel_moves.restype = ctypes.c_int
+    lib.accel_apply.argtypes = (
+        [ctypes.c_char_p, ctypes.c_int] + rules
+        + [ctypes.c_char_p, ctypes.c_char_p])
+    lib.accel_apply.restype = ctypes.c_int
+    lib.accel_key.argtypes = (
+        [ctypes.c_char_p, ctypes.c_int] + rules + [ctypes.c_char_p])
+    lib.accel_key.restype = ctypes.c_int
+    return lib
+
+
+_lib = _load()
+available = _lib is not None
+
+
+def _rules(game_state):
+    rules = game_state.rules
+    redeals = -1 if rules.redeals is None else rules.redeals
+    return rules.draw, redeals, int(rules.foundation_to_tableau)
+
+
+def _move_from_bytes(data):
+    move_type = _MOVE_TYPES[data[0]]
+    if move_type is MoveTableauToTableau:
+        return move_type(data[1], data[2], data[3])
+    if move_type is MoveFoundationToTableau:
+        return move_type(data[1], data[2])
+    if move_type in (MoveTableauToFoundation, MoveWasteToTableau):
+        return move_type(data[1])
+    return move_type()
+
+
+def _move_to_bytes(move):
+    if isinstance(move, MoveTableauToTableau):
+        numbers = [move.source_col, move.source_row, move.target_col]
+    elif isinstance(move, MoveFoundationToTableau):
+        numbers = [move.source_col, move.target_col, 0]
+    elif isinstance(move, MoveTableauToFoundation):
+        numbers = [move.source_col, 0, 0]
+    elif isinstance(move, MoveWasteToTableau):
+        numbers = [move.target_col, 0, 0]
+    else:
+        numbers = [0, 0, 0]
+    return bytes([_MOVE_TYPES.index(type(move))] + numbers)
+
+
+def _moves_from_bytes(data, count):
+    return [_move_from_bytes(data[i * 4:i * 4 + 4]) for i in range(count)]
+
+
+def valid_moves(game_state, prune=False):
+    """
+    The C version of game_state.valid_moves(), or list(pruned_moves()) with
+    prune.
+    """
+    packed = game_state.pack()
+    moves = ctypes.create_string_buffer(_MAX_MOVES * 4)
+    count = _lib.accel_moves(
+        packed, len(packed), *_rules(game_state), int(prune), moves)
+    if count < 0:
+        raise ValueError("Can't handle this game state")
+    return _moves_from_bytes(moves.raw, count)
+
+
+def apply_move(game_state, move):
+    """
+    The C version of game_state.apply_move(move).
+    """
+    packed = game_state.pack()
+    new_packed = ctypes.create_string_buffer(_MAX_PACKED)
+    length = _lib.accel_apply(
+        packed, len(packed), *_rules(game_state), _move_to_bytes(move),
+        new_packed)
+    if length < 0:
+        raise ValueError("Can't make that move")
+    return type(game_state).unpack(new_packed.raw[:length], game_state.rules)
+
+
+def key(game_state):
+    """
+    The C version of game_state.key().
+    """
+    packed = game_state.pack()
+    key_buffer = ctypes.create_string_buffer(_MAX_PACKED)
+    length = _lib.accel_key(
+        packed, len(packed), *_rules(game_state), key_buffer)
+    if length < 0:
+        raise ValueError("Can't handle this game state")
+    return key_buffer.raw[:length]
+
+
+class AcceleratedSearch(object):
+    """
+    The same as DepthFirstSearch with the default ordering, visited and
+    table, and with or without pruning, but in C. It has the same run(),
+    finished, solution, lost and sample(), but no transposition table to
+    look at afterwards, so tt_hits and tt_misses are always 0.
+
+    Raises ValueError for a game state the C can't hold (a column or pile
+    with more than 52 cards).
+    """
+    def __init__(self, game_state, prune=True):
+        packed = game_state.pack()
+        self._search = _lib.accel_search_new(
+            packed, len(packed), *_rules(game_state), int(prune))
+        if not self._search:
+            raise ValueError("Can't handle this game state")
+
+        self.solution = None
+        self.lost = False
+        self._info = (ctypes.c_long * 7)()
+        self._update()
+
+    def _update(self):
+        _lib.accel_search_info(self._search, self._info)
+        (self.nodes, self.depth, self.max_depth, self.expanded,
+         self.moves_generated, status, length) = self._info
+
+        if status == _WON and self.solution is None:
+            moves = ctypes.create_string_buffer(max(length, 1) * 4)
+            _lib.accel_search_solution(self._search, moves)
+            self.solution = _moves_from_bytes(moves.raw, length)
+        self.lost = status == _LOST
+        self.status = status
+
+    @property
+    def finished(self):
+        return self.status != _RUNNING
+
+    def run(self, max_nodes=None):
+        """
+        Search until finished or max_nodes new states have been visited, like
+        DepthFirstSearch.run(). Raises MemoryError if the C runs out.
+        """
+        finished = _lib.accel_search_run(
+            self._search, -1 if max_nodes is None else max_nodes)
+        self._update()
+        if finished < 0:
+            raise MemoryError("Out of memory in the accelerated search")
+        return bool(finished)
+
+    def sample(self):
+        return SearchStats(
+            self.nodes, self.depth, self.max_depth, 0, 0,
+            self.moves_generated / self.expanded if self.expanded else 0.0)
+
+    def __del__(self):
+        if getattr(self, "_search", None):
+            _lib.accel_search_free(self._search)
+            self._search = None
@@ -0,0 +1,197 @@
+"""
+Solve lots of deals at once, spread across a pool of worker processes.
+
+Each deal gets its own search in whichever worker picks it up, with its own
+node and time budget, and results come back (as JSON lines from the command
+line) in the order the deals finish rather than the order they went in.
+
+    python batch.py --count 1000 --seed 1 --max-seconds 10
+    python batch.py --file deals.txt --processes 64 --max-nodes 1000000
+
+A file of deals has one deal per line, written by solitaire.deck_to_string().
+Moves in the output are lists of the move's class name and its arguments,
+like ["MoveTableauToTableau", 3, 1, 5]; solitaire.move_from_list() turns
+them back into moves.
+
+With --database, results are kept in a SQLite file (see solution_db), and
+deals already won or lost there aren't solved again:
+
+    python batch.py --count 1000 --max-seconds 10 --database solutions.db
+"""
+
+import argparse
+import json
+import sys
+from multiprocessing import Pool
+from random import Random
+
+from solitaire import (
+    DECK, UNKNOWN, GameState, SolveResult, deck_from_string, deck_to_string,
+    move_from_list, move_to_list, solve)
+from solution_db import SolutionDatabase
+
+
+def seeded_deals(count, seed=0):
+    """
+    Yield (deal_id, deck) for count shuffled decks, the same ones every time
+    for the same seed.
+    """
+    rng = Random(seed)
+    for deal_id in range(count):
+        deck = list(DECK)
+        rng.shuffle(deck)
+        yield deal_id, deck
+
+
+def deals_from_file(path):
+    """
+    Yield (deal_id, deck) for each deal in a file, where deal_id is the line
+    number. Blank lines and lines starting with # are skipped.
+    """
+    with open(path) as deal_file:
+        for line_number, line in enumerate(deal_file, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line_number, deck_from_string(line)
+
+
+def solve_deal(job):
+    """
+    Solve one deal in a worker. job is (deal_id, deck as a string, max_nodes,
+    max_seconds, max_memory); returns a dict describing what happened.
+    """
+    deal_id, deck, max_nodes, max_seconds, max_memory = job
+
+    result = solve(
+        GameState(deck_from_string(deck)), max_nodes=max_nodes,
+        max_seconds=max_seconds, max_memory=max_memory)
+    return _output(deal_id, deck, result)
+
+
+def _output(deal_id, deck, result):
+    """
+    The dict solve_deal() returns for a SolveResult.
+    """
+    output = {
+        "deal": deal_id,
+        "deck": deck,
+        "result": result.status,
+        "exhausted": result.exhausted,
+        "moves": (
+            None if result.moves is None
+            else [move_to_list(move) for move in result.moves]),
+    }
+    output.update(result.stats)
+    return output
+
+
+def _result(output):
+    """
+    The SolveResult a solve_deal() dict came from.
+    """
+    stats = dict(output)
+    for name in ["deal", "deck", "result", "exhausted", "moves"]:
+        del stats[name]
+    moves = output["moves"]
+    if moves is not None:
+        moves = [move_from_list(move) for move in moves]
+    return SolveResult(output["result"], moves, output["exhausted"], stats)
+
+
+def solve_deals(
+        deals, processes=None, max_nodes=None, max_seconds=None,
+        max_memory=None, database=None):
+    """
+    Solve every (deal_id, deck) in deals using a pool of processes (one per
+    CPU by default), yielding solve_deal() results as each deal finishes.
+    The budgets are for each deal. max_memory is checked against the whole
+    worker process, so when it's given each deal gets a fresh worker-
+    otherwise memory left over from one deal would count against the next.
+
+    database is a solution_db.SolutionDatabase, or None. Deals it already
+    knows are won or lost aren't solved again- their stored results come
+    out first, with "cached" set to True- and everything else that gets
+    solved is stored in it.
+    """
+    if database is not None:
+        unknown = []
+        for deal_id, deck in deals:
+            result = database.lookup(deck)
+            if result is None or result.status == UNKNOWN:
+                unknown.append((deal_id, deck))
+            else:
+                output = _output(deal_id, deck_to_string(deck), result)
+                output["cached"] = True
+                yield output
+        deals = unknown
+
+    jobs = (
+        (deal_id, deck_to_string(deck), max_nodes, max_seconds, max_memory)
+        for deal_id, deck in deals)
+
+    maxtasksperchild = None
+    if max_memory is not None:
+        maxtasksperchild = 1
+
+    with Pool(processes, maxtasksperchild=maxtasksperchild) as pool:
+        for output in pool.imap_unordered(solve_deal, jobs):
+            if database is not None:
+                database.store(
+                    deck_from_string(output["deck"]), _result(output))
+            yield output
+    if database is not None:
+        database.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--count", type=int, help="solve this many randomly shuffled deals")
+    source.add_argument("--file", help="solve the deals in this file")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed for shuffling with --count")
+    parser.add_argument(
+        "--processes", type=int, default=None,
+        help="worker processes (default: one per CPU)")
+    parser.add_argument(
+        "--max-nodes", type=int, default=None,
+        help="give up on a deal after searching this many states")
+    parser.add_argument(
+        "--max-seconds", type=float, default=None,
+        help="give up on a deal after this long")
+    parser.add_argument(
+        "--max-memory", type=float, default=None,
+        help="give up on a deal once its worker uses this many megabytes")
+    parser.add_argument(
+        "--database",
+        help="SQLite file of results to skip deals already solved and store "
+        "new results in")
+    args = parser.parse_args(argv)
+
+    if args.file is not None:
+        deals = deals_from_file(args.file)
+    else:
+        deals = seeded_deals(args.count, args.seed)
+
+    max_memory = None
+    if args.max_memory is not None:
+        max_memory = int(args.max_memory * 1024 * 1024)
+
+    database = None
+    if args.database is not None:
+        database = SolutionDatabase(args.database)
+
+    try:
+        for result in solve_deals(
+                deals, args.processes, args.max_nodes, args.max_seconds,
+                max_memory, database):
+            print(json.dumps(result))
+            sys.stdout.flush()
+    finally:
+        if database is not None:
+            database.close()
+
+
+if __name__ == "__main__":
+    main()
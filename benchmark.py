@@ -0,0 +1,222 @@
+"""
+Measure how fast the solver is, on a fixed corpus of deals so that the
+numbers can be compared from one version to the next.
+
+    python benchmark.py --output results.json
+    python benchmark.py --compare results.json
+
+The corpus (benchmark_corpus.json) has easy, medium and hard deals that can
+be won, and some that can't. For each one this reports the result, nodes
+searched per second, time to the result and the peak memory of the process
+that solved it (each deal is solved in a fresh process so that's
+meaningful). It also times valid_moves() and apply_move() on their own, on
+states from random play through the corpus deals.
+
+Everything is written out as JSON. --compare reads an earlier run and says
+what got slower, or gave a different result.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from multiprocessing import Pool
+from random import Random
+
+from solitaire import UNKNOWN, GameState, deck_from_string, solve
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+CORPUS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmark_corpus.json")
+
+# Something that takes this much longer than it used to counts as slower, as
+# long as it's also at least REGRESSION_MIN_SECONDS slower (timings of really
+# quick deals jump around too much)
+REGRESSION_THRESHOLD = 1.1
+REGRESSION_MIN_SECONDS = 0.05
+
+
+def load_corpus(path=CORPUS_PATH):
+    """
+    Return the list of deals in a corpus file. Each one is a dict with a
+    name, a category, the deck (as written by deck_to_string()) and the
+    expected result.
+    """
+    with open(path) as corpus_file:
+        return json.load(corpus_file)["deals"]
+
+
+def sample_states(deals, count, seed=0, length=30):
+    """
+    Return count states reached by random play (up to length moves) from
+    the deals, the same ones every time for the same seed.
+    """
+    rng = Random(seed)
+    states = []
+    while len(states) < count:
+        deal = deals[len(states) % len(deals)]
+        state = GameState(deck_from_string(deal["deck"]))
+        for _ in range(rng.randrange(length)):
+            state = state.apply_move(rng.choice(state.valid_moves()))
+        states.append(state)
+    return states
+
+
+def time_valid_moves(states, min_seconds=1.0):
+    """
+    How many states per second valid_moves() gets through.
+    """
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_seconds:
+        for state in states:
+            state.valid_moves()
+        count += len(states)
+    return count / (time.perf_counter() - start)
+
+
+def time_apply_move(states, min_seconds=1.0):
+    """
+    How many new states per second apply_move() makes.
+    """
+    pairs = [(state, move) for state in states for move in state.valid_moves()]
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_seconds:
+        for state, move in pairs:
+            state.apply_move(move)
+        count += len(pairs)
+    return count / (time.perf_counter() - start)
+
+
+def peak_memory():
+    """
+    Peak resident memory of this process in bytes, or None if we can't tell.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def run_deal(job):
+    """
+    Solve one corpus deal. job is (deal, max_nodes, max_seconds).
+    """
+    deal, max_nodes, max_seconds = job
+    state = GameState(deck_from_string(deal["deck"]))
+    result = solve(state, max_nodes=max_nodes, max_seconds=max_seconds)
+
+    seconds = result.stats["seconds"]
+    return {
+        "name": deal["name"],
+        "category": deal["category"],
+        "expected": deal["expected"],
+        "result": result.status,
+        "moves": None if result.moves is None else len(result.moves),
+        "nodes": result.stats["nodes"],
+        "seconds": seconds,
+        "nodes_per_second": result.stats["nodes"] / seconds if seconds else None,
+        "peak_memory": peak_memory(),
+    }
+
+
+def run_benchmark(deals, max_nodes=None, max_seconds=None, sample_count=200):
+    states = sample_states(deals, sample_count)
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "max_nodes": max_nodes,
+        "max_seconds": max_seconds,
+        "valid_moves_per_second": time_valid_moves(states),
+        "apply_move_per_second": time_apply_move(states),
+        "deals": [],
+    }
+
+    # one deal at a time, each in a new process, so they don't compete for
+    # the CPU and the peak memory is just for that deal
+    jobs = [(deal, max_nodes, max_seconds) for deal in deals]
+    with Pool(1, maxtasksperchild=1) as pool:
+        output["deals"] = pool.map(run_deal, jobs, chunksize=1)
+
+    return output
+
+
+def compare(old, new):
+    """
+    Return a list of lines describing how new benchmark output is worse than
+    old.
+    """
+    problems = []
+    for name in ["valid_moves_per_second", "apply_move_per_second"]:
+        if old[name] > new[name] * REGRESSION_THRESHOLD:
+            problems.append("{}: {:.0f} -> {:.0f}".format(
+                name, old[name], new[name]))
+
+    old_deals = dict((deal["name"], deal) for deal in old["deals"])
+    for deal in new["deals"]:
+        if deal["result"] != deal["expected"] and deal["result"] != UNKNOWN:
+            problems.append("{}: expected {} but got {}".format(
+                deal["name"], deal["expected"], deal["result"]))
+
+        old_deal = old_deals.get(deal["name"])
+        if old_deal is None:
+            continue
+
+        if old_deal["result"] != UNKNOWN and deal["result"] == UNKNOWN:
+            problems.append("{}: {} -> {}".format(
+                deal["name"], old_deal["result"], deal["result"]))
+        elif (
+                deal["seconds"] > old_deal["seconds"] * REGRESSION_THRESHOLD
+                and deal["seconds"] - old_deal["seconds"]
+                > REGRESSION_MIN_SECONDS):
+            problems.append("{}: {:.3f}s -> {:.3f}s".format(
+                deal["name"], old_deal["seconds"], deal["seconds"]))
+
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument(
+        "--category", action="append",
+        help="only run deals in this category (can be repeated)")
+    parser.add_argument("--max-nodes", type=int, default=None)
+    parser.add_argument("--max-seconds", type=float, default=60)
+    parser.add_argument("--output", help="write results here, not stdout")
+    parser.add_argument(
+        "--compare", help="earlier results to check these against")
+    args = parser.parse_args(argv)
+
+    deals = load_corpus(args.corpus)
+    if args.category:
+        deals = [deal for deal in deals if deal["category"] in args.category]
+
+    output = run_benchmark(deals, args.max_nodes, args.max_seconds)
+
+    text = json.dumps(output, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as output_file:
+            output_file.write(text + "\n")
+
+    if args.compare is not None:
+        with open(args.compare) as old_file:
+            problems = compare(json.load(old_file), output)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+"""
+Search one deal with several worker processes at once, for when it's the
+time to solve a single hard deal that matters (batch.py is for lots of
+deals).
+
+    result = parallel_solve(GameState(deck), processes=8)
+
+The first few moves are tried in this process, breadth first, until there
+are a few states per worker, and each of those is a task: a depth-first
+search of everything reachable from it. When a worker runs out of tasks
+while others are still busy, a busy worker gives away the untried moves
+nearest the top of its search as new tasks (work stealing), so the work
+keeps getting shared out however lopsided the tree is.
+
+Workers share the states they prove won or lost through a
+SharedTranspositionTable, so one worker doesn't search what another already
+has. As soon as any worker finds a win, all of them stop and that's the
+solution. If every task is searched without a win, the game is lost.
+
+The workers run the Python DepthFirstSearch, since the C one (see accel)
+can't share work or losses. That's a lot slower per process, so with only
+a few processors a plain solve() in C is still faster.
+"""
+
+import struct
+import time
+import traceback
+from hashlib import blake2b
+from multiprocessing import Event, Lock, Process, Queue, Value, shared_memory
+from queue import Empty
+
+from solitaire import (
+    LOST, UNKNOWN, WON, DepthFirstSearch, GameState, MoveFoundationToTableau,
+    MoveFromStock, MoveTableauToFoundation, MoveTableauToTableau,
+    MoveWasteToFoundation, MoveWasteToTableau, SolveResult, TurnStock,
+    _column_bottoms, _renumber_move, expand_moves, foundation_first,
+    pruned_moves)
+
+
+# how many states each worker searches between looking for messages
+CHUNK_NODES = 2000
+
+
+def fingerprint(key):
+    """
+    A 64 bit fingerprint of a state's key(), which is the same in every
+    process (unlike hash()) and never 0.
+    """
+    value = int.from_bytes(blake2b(key, digest_size=8).digest(), "little")
+    return value or 1
+
+
+# moves as 4 bytes, [kind, a, b, c], with the same kinds as accel uses, and
+# one more for MoveFromStock: [6, turns, kind of move, its column]
+_MOVE_KINDS = [
+    TurnStock, MoveTableauToTableau, MoveTableauToFoundation,
+    MoveWasteToTableau, MoveWasteToFoundation, MoveFoundationToTableau,
+    MoveFromStock]
+
+
+def _move_to_bytes(move):
+    kind = _MOVE_KINDS.index(type(move))
+    if isinstance(move, MoveTableauToTableau):
+        numbers = [move.source_col, move.source_row, move.target_col]
+    elif isinstance(move, MoveFoundationToTableau):
+        numbers = [move.source_col, move.target_col, 0]
+    elif isinstance(move, MoveTableauToFoundation):
+        numbers = [move.source_col, 0, 0]
+    elif isinstance(move, MoveWasteToTableau):
+        numbers = [move.target_col, 0, 0]
+    elif isinstance(move, MoveFromStock):
+        inner = _move_to_bytes(move.move)
+        numbers = [move.turns, inner[0], inner[1]]
+    else:
+        numbers = [0, 0, 0]
+    return bytes([kind] + numbers)
+
+
+def _move_from_bytes(data):
+    kind = _MOVE_KINDS[data[0]]
+    if kind is MoveTableauToTableau:
+        return kind(data[1], data[2], data[3])
+    if kind is MoveFoundationToTableau:
+        return kind(data[1], data[2])
+    if kind in (MoveTableauToFoundation, MoveWasteToTableau):
+        return kind(data[1])
+    if kind is MoveFromStock:
+        return kind(data[1], _move_from_bytes(bytes([data[2], data[3], 0, 0])))
+    return kind()
+
+
+class SharedTranspositionTable(object):
+    """
+    A TranspositionTable that lives in shared memory, so that searches in
+    different processes- working on the same deal, or on deals that run
+    into the same states- can all use what any of them has proven.
+
+    Each entry is 20 bytes: a 64 bit fingerprint of the state's key(), a
+    flag (nothing known yet, WON or LOST), and for a won state the move to
+    make (4 bytes) and the bottom card of each column, which is what the
+    move's columns get renumbered by (see TranspositionTable). Like
+    FingerprintSet, two different states with the same fingerprint would
+    look the same, but with 64 bits that's very unlikely.
+
+    The slots are split into stripes, each with its own lock, so processes
+    only wait for each other when they want the same stripe at once. A
+    state's fingerprint picks its stripe and its home slot in the stripe,
+    and it can go in that slot or the max_probes after it (going round to
+    the start of the stripe). If they're all taken, the one in its home
+    slot gets replaced (and evictions goes up in this process). That's
+    safe: a lost state just gets searched again, and a search that can't
+    follow a win all the way to the end ignores it.
+
+    Locks can only be handed to another process when it starts, so to use
+    the table in another process pass it to Process() (or a Pool's
+    initializer); it attaches to the same memory there. The process that
+    made the table should unlink() it once everyone is done.
+    """
+    ENTRY = struct.Struct("<QB4s7s")
+
+    def __init__(self, capacity=1 << 20, max_probes=16, stripes=64):
+        # a whole number of slots in every stripe
+        self.stripe_size = max(-(-capacity // stripes), max_probes)
+        self.capacity = self.stripe_size * stripes
+        self.max_probes = max_probes
+        # new shared memory always starts out as zeros, which is empty
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=self.capacity * self.ENTRY.size)
+        self.locks = [Lock() for _ in range(stripes)]
+        self.count = Value("q", 0)
+        self.evictions = 0
+
+    def __getstate__(self):
+        return (
+            self.stripe_size, self.capacity, self.max_probes,
+            self.memory.name, self.locks, self.count)
+
+    def __setstate__(self, state):
+        (self.stripe_size, self.capacity, self.max_probes, name, self.locks,
+         self.count) = state
+        self.memory = shared_memory.SharedMemory(name=name)
+        self.evictions = 0
+
+    def _find(self, value, claim):
+        """
+        The slot holding fingerprint value, or None. With claim, it's the
+        slot to store it in instead, and it always finds one. Call with the
+        stripe's lock held. Returns (slot, whether it was empty).
+        """
+        buf = self.memory.buf
+        size = self.ENTRY.size
+        stripe_size = self.stripe_size
+        first = value % len(self.locks) * stripe_size
+        home = value // len(self.locks) % stripe_size
+        for probe in range(self.max_probes):
+            slot = first + (home + probe) % stripe_size
+            found = int.from_bytes(
+                buf[slot * size:slot * size + 8], "little")
+            if found == value:
+                return slot, False
+            if found == 0:
+                return (slot, True) if claim else (None, False)
+        if claim:
+            self.evictions += 1
+            return first + home, False
+        return None, False
+
+    def _lock(self, value):
+        return self.locks[value % len(self.locks)]
+
+    def _get(self, key):
+        value = fingerprint(key)
+        with self._lock(value):
+            slot, _ = self._find(value, False)
+            if slot is None:
+                return None
+            size = self.ENTRY.size
+            return self.ENTRY.unpack(
+                self.memory.buf[slot * size:(slot + 1) * size])
+
+    def _put(self, key, flag, move=b"\0\0\0\0", bottoms=b"\0" * 7):
+        value = fingerprint(key)
+        with self._lock(value):
+            slot, empty = self._find(value, True)
+            size = self.ENTRY.size
+            self.memory.buf[slot * size:(slot + 1) * size] = self.ENTRY.pack(
+                value, flag, move, bottoms)
+        if empty:
+            with self.count.get_lock():
+                self.count.value += 1
+
+    def lookup(self, game_state):
+        """
+        Return (WON, move) or (LOST, None) for a state we know about, or None.
+        """
+        entry = self._get(game_state.key())
+        if entry is None:
+            return None
+        _, flag, move, bottoms = entry
+        if flag == _FLAGS[LOST]:
+            return LOST, None
+        if flag == _FLAGS[WON]:
+            return WON, _renumber_move(
+                _move_from_bytes(move), _bottoms_from_bytes(bottoms),
+                game_state)
+        return None
+
+    def store_won(self, game_state, move):
+        self._put(
+            game_state.key(), _FLAGS[WON], _move_to_bytes(move),
+            bytes(
+                255 if index is None else index
+                for index in _column_bottoms(game_state)))
+
+    def store_lost(self, game_state):
+        self.store_lost_key(game_state.key())
+
+    def store_lost_key(self, key):
+        self._put(key, _FLAGS[LOST])
+
+    def solution(self, game_state):
+        """
+        Follow the stored moves from a won game_state to the end of the game.
+        Returns None if part of the way has been lost.
+        """
+        moves = []
+        seen = set()
+        while not game_state.is_won():
+            entry = self.lookup(game_state)
+            # another process could have stored a different way to win
+            # since, so make sure not to go round in circles
+            if entry is None or entry[0] != WON or game_state.key() in seen:
+                return None
+            seen.add(game_state.key())
+            moves.append(entry[1])
+            game_state = game_state.apply_move(entry[1])
+        return moves
+
+    def __len__(self):
+        return self.count.value
+
+    def close(self):
+        """
+        Let go of the shared memory in this process.
+        """
+        self.memory.close()
+
+    def unlink(self):
+        """
+        Free the shared memory, once every process has closed it.
+        """
+        self.memory.unlink()
+
+
+_FLAGS = {WON: 1, LOST: 2}
+
+
+def _bottoms_from_bytes(data):
+    return tuple(None if index == 255 else index for index in data)
+
+
+def split(game_state, count, ordering=foundation_first, prune=True,
+          macros=False):
+    """
+    Expand game_state breadth first until there are at least count states
+    to start searches from (or there's nothing left to expand). Returns a
+    list of (moves, state) for them- the moves that get there from
+    game_state- or [(moves, won_state)] if it comes across a win.
+    """
+    frontier = [([], game_state)]
+    seen = set([game_state.key()])
+    while 0 < len(frontier) < count:
+        next_frontier = []
+        for moves, state in frontier:
+            if prune:
+                children = pruned_moves(state, ordering, macros)
+            else:
+                children = ordering(state, macros)
+            for move in children:
+                child = state.apply_move(move)
+                if child.is_won():
+                    return [(moves + [move], child)]
+                if child.key() not in seen:
+                    seen.add(child.key())
+                    next_frontier.append((moves + [move], child))
+        frontier = next_frontier
+    return frontier
+
+
+def _give_away(search):
+    """
+    Take the untried moves out of the highest frame of search's stack that
+    has any, and return them as new tasks: (moves from the search's start,
+    packed state). The frame is marked uncertain, since it won't have tried
+    everything itself.
+    """
+    for depth, frame in enumerate(search.stack):
+        moves = list(frame[1])
+        if moves:
+            frame[1] = iter(())
+            frame[5] = False
+            path = [earlier[2] for earlier in search.stack[:depth]]
+            return [
+                (path + [move], frame[0].apply_move(move).pack())
+                for move in moves]
+    return []
+
+
+def _worker(
+        tasks, results, stop, idle, table, rules, ordering, prune, macros,
+        chunk_nodes):
+    try:
+        _work(
+            tasks, results, stop, idle, table, rules, ordering, prune, macros,
+            chunk_nodes)
+    except Exception:
+        # tell the main process, or it would wait for this one forever
+        results.put(("error", traceback.format_exc()))
+    finally:
+        # anything given away after everyone was told to stop can't be left
+        # holding up this process's exit
+        tasks.cancel_join_thread()
+        table.close()
+
+
+def _work(
+        tasks, results, stop, idle, table, rules, ordering, prune, macros,
+        chunk_nodes):
+    while True:
+        with idle.get_lock():
+            idle.value += 1
+        task = tasks.get()
+        with idle.get_lock():
+            idle.value -= 1
+        if task is None:
+            break
+
+        path, packed = task
+        search = DepthFirstSearch(
+            GameState.unpack(packed, rules), table=table, ordering=ordering,
+            prune=prune, macros=macros)
+        nodes = 0
+        while not search.finished and not stop.is_set():
+            search.run(max_nodes=chunk_nodes)
+            results.put(("nodes", search.nodes - nodes))
+            nodes = search.nodes
+
+            if idle.value > 0 and tasks.empty() and not search.finished:
+                given = _give_away(search)
+                if given:
+                    # the main process hands these out, so that it counts
+                    # them before this task's "done" (which comes after
+                    # them on the same queue) and they can't be done before
+                    # it knows about them
+                    results.put(("split", [
+                        (path + moves, child) for moves, child in given]))
+
+        solution = None
+        if search.solution is not None:
+            solution = path + search.solution
+        results.put(("done", solution))
+
+
+def parallel_solve(
+        game_state, processes=4, max_nodes=None, max_seconds=None,
+        ordering=foundation_first, prune=True, macros=False,
+        table=None, first_tasks=None, chunk_nodes=CHUNK_NODES):
+    """
+    Solve game_state with processes worker processes, and return a
+    SolveResult like solve(). See the top of this module.
+
+    The budgets are for all the workers together. Workers report how many
+    states they've searched, and check whether they should stop or give
+    some work away, every chunk_nodes states, so the search can go a little
+    over max_nodes. ordering, prune and macros are the same as for solve().
+    table is a SharedTranspositionTable for the workers to share, which
+    can come from (and go on to) other searches of the same or related
+    deals; by default there's a new one just for this search. first_tasks
+    is how many states to split the start into (4 per worker by default).
+
+    stats has nodes, seconds, processes, tasks (how many there were
+    altogether) and steals (how many of those were given away by busy
+    workers).
+    """
+    start = time.time()
+    if game_state.is_won():
+        return SolveResult(WON, [], stats=dict(nodes=0, seconds=0.0))
+
+    if first_tasks is None:
+        first_tasks = processes * 4
+    first_tasks = split(game_state, first_tasks, ordering, prune, macros)
+    if len(first_tasks) == 1 and first_tasks[0][1].is_won():
+        return SolveResult(
+            WON, expand_moves(first_tasks[0][0]),
+            stats=dict(nodes=0, seconds=time.time() - start))
+
+    own_table = table is None
+    if own_table:
+        table = SharedTranspositionTable()
+    tasks = Queue()
+    results = Queue()
+    stop = Event()
+    idle = Value("i", 0)
+    workers = []
+    outstanding = len(first_tasks)
+    steals = 0
+    nodes = 0
+    solution = None
+    exhausted = None
+    error = None
+
+    try:
+        for _ in range(processes):
+            worker = Process(
+                target=_worker,
+                args=(
+                    tasks, results, stop, idle, table, game_state.rules,
+                    ordering, prune, macros, chunk_nodes))
+            worker.start()
+            workers.append(worker)
+        for moves, state in first_tasks:
+            tasks.put((moves, state.pack()))
+
+        while outstanding:
+            if max_seconds is not None and time.time() - start >= max_seconds:
+                exhausted = "seconds"
+                break
+            try:
+                message = results.get(timeout=0.1)
+            except Empty:
+                continue
+
+            if message[0] == "nodes":
+                nodes += message[1]
+                if max_nodes is not None and nodes >= max_nodes:
+                    exhausted = "nodes"
+                    break
+            elif message[0] == "split":
+                outstanding += len(message[1])
+                steals += len(message[1])
+                for task in message[1]:
+                    tasks.put(task)
+            elif message[0] == "error":
+                error = message[1]
+                break
+            else:
+                outstanding -= 1
+                if message[1] is not None:
+                    solution = message[1]
+                    break
+
+        # stop everyone, and keep reading messages so nobody gets stuck
+        # trying to send one
+        stop.set()
+        for _ in workers:
+            tasks.put(None)
+        while any(worker.is_alive() for worker in workers):
+            try:
+                results.get(timeout=0.05)
+            except Empty:
+                pass
+    finally:
+        # only still running if something went wrong here
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        tasks.cancel_join_thread()
+        if own_table:
+            table.close()
+            table.unlink()
+
+    if error is not None:
+        raise RuntimeError("a worker process failed:\n" + error)
+
+    if solution is not None:
+        status = WON
+        solution = expand_moves(solution)
+    elif exhausted is None:
+        status = LOST
+    else:
+        status = UNKNOWN
+
+    stats = dict(
+        nodes=nodes, seconds=time.time() - start, processes=processes,
+        tasks=len(first_tasks) + steals, steals=steals)
+    return SolveResult(status, solution, exhausted, stats)
@@ -14,9 +14,16 @@ from the top of a real-world stack" and "append" means "put a card physically
 on top of a stack". 
 """
 
+import mmap
+import os
+import shutil
 import sys
+import tempfile
+import time
+from collections import OrderedDict
 from copy import deepcopy
-from random import shuffle
+from heapq import heappop, heappush, merge
+from random import Random, shuffle
 
 
 SUITS = ["Spades", "Diamonds", "Clubs", "Hearts"]
@@ -24,24 +31,30 @@ RANKS = [
     "Ace", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Jack", "Queen",
     "King"]
 
-# Once we've solved a particular state, cache the solution
-# Is this going to get huge?!
-# Will this be helpful?
-CACHE = dict()
-CACHE_HITS = 0
-
-
-MAXDEPTH = 0
+class Card(object):
+    """
+    There are only ever 52 Card objects: Card(rank, suit) hands back the one
+    for that rank and suit, so a GameState is just lists of references to the
+    same cards and copying one never copies cards.
 
+    Each card also has an index from 0 to 51 (suit * 13 + rank, the same as
+    its position in DECK), which is what GameState.pack() stores.
+    """
+    __slots__ = ("rank", "suit", "index")
 
-class Card(object):
-    def __init__(self, rank, suit):
+    def __new__(cls, rank, suit):
         """
         Suit and rank are integers!
         """
-        self.suit = suit
-        self.rank = rank
-        
+        if not (0 <= rank < 13 and 0 <= suit < 4):
+            raise ValueError("No such card: rank {}, suit {}".format(
+                rank, suit))
+        return _CARDS[suit * 13 + rank]
+
+    @staticmethod
+    def from_index(index):
+        return _CARDS[index]
+
     def fits_under(self, over):
         different_colors = bool((self.suit - over.suit) % 2)
         sequential = (over.rank - self.rank == 1)
@@ -57,20 +70,131 @@ class Card(object):
         return self.suit == other.suit and self.rank == other.rank
 
     def __hash__(self):
-        return hash((self.suit, self.rank))
+        return self.index
 
     def __lt__(self, other):
         # sort by suit then by rank
-        return (self.suit, self.rank) < (other.suit, other.rank)
+        return self.index < other.index
+
+    # cards are never modified, so copies can just be the same card
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Card, (self.rank, self.suit))
+
 
+def _make_card(index):
+    card = object.__new__(Card)
+    card.rank = index % 13
+    card.suit = index // 13
+    card.index = index
+    return card
 
-DECK = [Card(rank, suit) for suit in range(4) for rank in range(13)]
+
+_CARDS = tuple(_make_card(index) for index in range(52))
+DECK = list(_CARDS)
+
+# The indexes of the (two) cards each card fits under in the tableau- one
+# rank higher, in the two suits of the other color. Kings don't fit under
+# anything.
+_FITS_UNDER = tuple(
+    () if card.rank == 12 else tuple(sorted(
+        (suit * 13 + card.rank + 1) for suit in range(4)
+        if (suit - card.suit) % 2))
+    for card in _CARDS)
+
+
+# Random keys for GameState.zobrist(), one per card per place it can be. In
+# the stock and waste that's each position (at most 24). In the tableau it's
+# which card it's sitting on (or _BOTTOM if it's at the bottom of a column)
+# and whether it's face up.
+_zobrist_random = Random(0x50114143)
+_BOTTOM = 52
+
+
+def _zobrist_table(places, size=52):
+    return [
+        [_zobrist_random.getrandbits(64) for _ in range(size)]
+        for _ in range(places)]
+
+
+_ZOBRIST_STOCK = _zobrist_table(24)
+_ZOBRIST_WASTE = _zobrist_table(24)
+_ZOBRIST_TABLEAU = [_zobrist_table(53), _zobrist_table(53)]
+_ZOBRIST_FOUNDATION = _zobrist_table(4, 14)
+_ZOBRIST_REDEALS = _zobrist_table(1, 256)[0]
+
+
+def _zobrist_pile(table, cards, start=0):
+    """
+    XOR of the keys for cards sitting in a pile from position start upwards.
+    """
+    hash_ = 0
+    for position, card in enumerate(cards, start):
+        hash_ ^= table[position][card.index]
+    return hash_
+
+
+def _top_index(face_down, face_up):
+    """
+    Index of the card on top of a tableau column, or _BOTTOM if it's empty.
+    """
+    if face_up:
+        return face_up[-1].index
+    if face_down:
+        return face_down[-1].index
+    return _BOTTOM
 
 
 class InvalidMove(RuntimeError):
     pass
 
 
+class Rules(object):
+    """
+    Which version of the game is being played:
+
+    draw: how many cards turning the stock moves onto the waste (1 or 3)
+    redeals: how many times the waste can be turned back over to make a new
+      stock, or None for as many as you like
+    foundation_to_tableau: whether cards can come back off the foundation
+
+    A GameState carries its rules around with it. The rules are only looked
+    at once per move generated or made, never per card, so the default
+    rules don't cost anything over the game being hard-coded. Don't mix up
+    states with different rules in one search or transposition table.
+    """
+    def __init__(self, draw=3, redeals=None, foundation_to_tableau=True):
+        if draw < 1:
+            raise ValueError("Have to draw at least one card")
+        if redeals is not None and not 0 <= redeals < 256:
+            raise ValueError("redeals has to be between 0 and 255")
+        self.draw = draw
+        self.redeals = redeals
+        self.foundation_to_tableau = foundation_to_tableau
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Rules)
+            and (self.draw, self.redeals, self.foundation_to_tableau)
+            == (other.draw, other.redeals, other.foundation_to_tableau))
+
+    def __hash__(self):
+        return hash((self.draw, self.redeals, self.foundation_to_tableau))
+
+    def __repr__(self):
+        return "Rules(draw={}, redeals={}, foundation_to_tableau={})".format(
+            self.draw, self.redeals, self.foundation_to_tableau)
+
+
+# draw three, redeal forever
+DEFAULT_RULES = Rules()
+
+
 class GameState(object):
     """
     Represents the state of 4 areas the cards can be in:
@@ -94,8 +218,21 @@ class GameState(object):
       column contains two lists, a list of face-down cards and a list of
       face-up cards. In both cases the most readily available cards are at the
       end of the list.
+
+    The state also has the Rules being played by (rules), and how many times
+    the waste has been turned back over into the stock so far (redeals).
+    That only counts as part of the state if the rules limit it.
+
+    pack() turns all of that into at most 72 bytes (one byte per card, the
+    card's index, and one more for redeals if they're limited), and
+    GameState.unpack() turns those bytes back into a GameState. That's the
+    compact form to use when lots of states have to be kept around.
     """
-    def __init__(self, deck):
+    __slots__ = (
+        "tableau", "stock", "waste", "foundation", "rules", "redeals",
+        "_hash", "_key", "_tops")
+
+    def __init__(self, deck, rules=DEFAULT_RULES):
         # Deal tableau of 7 columns, with 1..7 cards. Each column consists of
         # two lists, upside-down cards and upside-up ones.
         # The rest go into the "stock". The waste is an initially empty list.
@@ -118,6 +255,14 @@ class GameState(object):
         # counts, how many cards are in each stack of the foundation
         self.foundation = [0, 0, 0, 0]
 
+        self.rules = rules
+        self.redeals = 0
+
+        # see zobrist(), key() and valid_moves()
+        self._hash = None
+        self._key = None
+        self._tops = None
+
     def __str__(self):
         output = "MOST READILY AVAILABLE CARDS ('TOP') AT END OF EACH LIST\n"
         output += "stock: {}\n".format(self.stock)
@@ -132,10 +277,83 @@ class GameState(object):
 
         return output
 
-    def valid_moves(self):
+    def pack(self):
         """
-        Return a list of Move objects representing all possible moves in the
-        current game state!
+        Return this state as bytes:
+
+        - 4 bytes: how many cards are on each foundation
+        - the stock: how many cards, then the index of each card
+        - the waste: the same
+        - for each column of the tableau: how many face-down cards, how many
+          face-up cards, then the indexes of the face-down cards followed by
+          the face-up cards
+        - if the rules limit redeals, how many there have been
+
+        The rules themselves aren't included- pass the same ones to unpack().
+        """
+        packed = bytearray(self.foundation)
+        for pile in (self.stock, self.waste):
+            packed.append(len(pile))
+            packed.extend(card.index for card in pile)
+        for face_down, face_up in self.tableau:
+            packed.append(len(face_down))
+            packed.append(len(face_up))
+            packed.extend(card.index for card in face_down)
+            packed.extend(card.index for card in face_up)
+        if self.rules.redeals is not None:
+            packed.append(self.redeals)
+        return bytes(packed)
+
+    @classmethod
+    def unpack(cls, packed, rules=DEFAULT_RULES):
+        """
+        Build a GameState from the output of pack(), for a game played by
+        rules.
+        """
+        def take(count):
+            nonlocal position
+            cards = [_CARDS[index] for index in packed[position:position + count]]
+            position += count
+            return cards
+
+        state = cls.__new__(cls)
+        state._hash = None
+        state._key = None
+        state._tops = None
+        state.rules = rules
+        state.redeals = 0
+        state.foundation = list(packed[:4])
+        position = 4
+
+        piles = []
+        for _ in range(2):
+            position += 1
+            piles.append(take(packed[position - 1]))
+        state.stock, state.waste = piles
+
+        state.tableau = []
+        for _ in range(7):
+            down_count, up_count = packed[position], packed[position + 1]
+            position += 2
+            face_down = take(down_count)
+            state.tableau.append([face_down, take(up_count)])
+
+        if rules.redeals is not None:
+            state.redeals = packed[position]
+
+        return state
+
+    def valid_moves(self, macros=False):
+        """
+        Return a list of all the moves iter_moves() yields.
+        """
+        return list(self.iter_moves(macros))
+
+    def iter_moves(self, macros=False):
+        """
+        Yield Move objects representing all possible moves in the current game
+        state! They're worked out as they're needed, so a search that only
+        gets as far as the first few doesn't pay for the rest.
 
         possible moves:
         - MoveTableauToFoundation(source_col)
@@ -143,93 +361,241 @@ class GameState(object):
         - MoveWasteToTableau(target_col)
         - MoveTableauToTableau(source_col, source_row, target_col)
         - TurnStock(): If the stock pile is empty, move the waste pile onto the
-          stock pile. Flip up to three cards from the stock pile onto the waste
-          pile. This is always possible (could make impossible if stock and
-          waste are both empty? but applying it in that case will result in an
-          unchanged game state which will be rejected as "visited")
-        - MoveFoundationToTableau(source_col, target_col)
-
-        return list in this order ^^^ so that solve() tries them in an order
+          stock pile. Flip up to three cards (or however many the rules say)
+          from the stock pile onto the waste pile. This is always possible
+          (could make impossible if stock and waste are both empty? but
+          applying it in that case will result in an unchanged game state
+          which will be rejected as "visited")- unless the rules limit
+          redeals, and then it's not if there are none left.
+        - MoveFoundationToTableau(source_col, target_col), if the rules allow
+          it
+
+        With macros, TurnStock() is replaced by a MoveFromStock for every
+        card that turning the stock would bring to the top of the waste and
+        that could then be played (see there).
+
+        yield them in this order ^^^ so that solve() tries them in an order
         that makes sense! Best to put things on the foundation when possible.
+
+        Rather than trying every card against every column, this looks up
+        where a card can go in an index of the columns' top cards (see
+        _make_tops()), which each move keeps up to date for just the columns
+        it changes. The Move objects are made once and shared, so don't
+        modify them.
         """
-        moves = []
+        tableau = self.tableau
+        foundation = self.foundation
+        tops = self._tops
+        if tops is None:
+            tops = self._tops = self._make_tops()
+        empty = [col for col in range(7) if not tableau[col][1]]
 
         # move tableau to foundation?
         for col in range(7):
-            if len(self.tableau[col][1]) == 0:
-                continue
-
-            card = self.tableau[col][1][-1]
-            if card.rank == self.foundation[card.suit]:
-                moves.append(MoveTableauToFoundation(col))
+            face_up = tableau[col][1]
+            if face_up:
+                card = face_up[-1]
+                if card.rank == foundation[card.suit]:
+                    yield _TABLEAU_TO_FOUNDATION[col]
 
-        # move waste to foundation?
-        if len(self.waste) > 0:
+        if self.waste:
             card = self.waste[-1]
-            if card.rank == self.foundation[card.suit]:
-                moves.append(MoveWasteToFoundation())
 
-        # move waste to tableau?
-        if len(self.waste) > 0:
-            card = self.waste[-1]
-            for target_col in range(7):
-                # is the target column empty?
-                if len(self.tableau[target_col][1]) == 0:
-                    # only a king can go here
-                    if card.rank == 12:
-                        moves.append(MoveWasteToTableau(target_col))
-                elif card.fits_under(self.tableau[target_col][1][-1]):
-                    moves.append(MoveWasteToTableau(target_col))
+            # move waste to foundation?
+            if card.rank == foundation[card.suit]:
+                yield _WASTE_TO_FOUNDATION
+
+            # move waste to tableau?
+            for target_col in _targets(card, tops, empty):
+                yield _WASTE_TO_TABLEAU[target_col]
 
         # move tableau to tableau?
         for col in range(7):
-            for row in range(len(self.tableau[col][1])):
-                for target_col in range(7):
-                    if target_col == col:
-                        continue
-
-                    top_card = self.tableau[col][1][row]
-
-                    # is the target column empty?
-                    if len(self.tableau[target_col][1]) == 0:
-                        # a king could go here
-                        if top_card.rank == 12:
-                            moves.append(MoveTableauToTableau(col, row, target_col))
-                    else:
-                        other_card = self.tableau[target_col][1][-1]
-                        if top_card.fits_under(other_card):
-                            moves.append(MoveTableauToTableau(col, row, target_col))
+            from_col = _TABLEAU_TO_TABLEAU[col]
+            for row, card in enumerate(tableau[col][1]):
+                for target_col in _targets(card, tops, empty):
+                    if target_col != col:
+                        yield from_col[row][target_col]
 
         # turn stock
-        moves.append(TurnStock())
+        rules = self.rules
+        if macros:
+            for turns, card in self._turned_cards():
+                if card.rank == foundation[card.suit]:
+                    yield MoveFromStock(turns, _WASTE_TO_FOUNDATION)
+                for target_col in _targets(card, tops, empty):
+                    yield MoveFromStock(turns, _WASTE_TO_TABLEAU[target_col])
+        elif (
+                self.stock or rules.redeals is None
+                or (self.waste and self.redeals < rules.redeals)):
+            yield _TURN_STOCK
 
         # move foundation to tableau?
+        if not rules.foundation_to_tableau:
+            return
         for suit in range(4):
             # can't do this if there are no cards
-            if self.foundation[suit] == 0:
+            count = foundation[suit]
+            if count == 0:
                 continue
-            
-            for target_col in range(7):
-                card = Card(self.foundation[suit] - 1, suit)
-                if len(self.tableau[target_col][1]) == 0:
-                    if card.rank == 12:
-                        moves.append(MoveFoundationToTableau(suit, target_col))
-                elif card.fits_under(self.tableau[target_col][1][-1]):
-                    moves.append(MoveFoundationToTableau(suit, target_col))
 
-        return moves
+            card = _CARDS[suit * 13 + count - 1]
+            for target_col in _targets(card, tops, empty):
+                yield _FOUNDATION_TO_TABLEAU[suit][target_col]
+
+    def _turned_cards(self):
+        """
+        Yield (turns, card) for each card that turns of the stock will bring
+        to the top of the waste, with the number of turns it takes, going
+        round once.
+        """
+        # the stock and waste are really one pile of cards, in this order,
+        # that's split somewhere- the first in_waste are in the waste
+        cards = self.waste + self.stock[::-1]
+        in_waste = len(self.waste)
+        draw = self.rules.draw
+        redeals_left = self.rules.redeals
+        if redeals_left is not None:
+            redeals_left -= self.redeals
+        seen = set([in_waste])
+        turns = 0
+        while True:
+            turns += 1
+            if in_waste == len(cards):
+                if redeals_left is not None:
+                    if redeals_left == 0:
+                        return
+                    redeals_left -= 1
+                in_waste = 0
+            in_waste = min(in_waste + draw, len(cards))
+            if in_waste in seen:
+                return
+            seen.add(in_waste)
+            if in_waste > 0:
+                yield turns, cards[in_waste - 1]
+
+    def _make_tops(self):
+        """
+        Return a dict of the index of each column's top face-up card to that
+        column. valid_moves() uses it to find where a card can go.
+        """
+        return dict(
+            (face_up[-1].index, col)
+            for col, (_, face_up) in enumerate(self.tableau) if face_up)
+
+    def _update_tops(self, parent, cols):
+        """
+        After a move from parent changed the given columns, fix up the top
+        card index copied from the parent- if the parent had one.
+        """
+        if parent._tops is None:
+            return
+        tops = dict(parent._tops)
+        for col in cols:
+            face_up = parent.tableau[col][1]
+            if face_up:
+                del tops[face_up[-1].index]
+            face_up = self.tableau[col][1]
+            if face_up:
+                tops[face_up[-1].index] = col
+        self._tops = tops
+
+    def _child(self):
+        """
+        Start a new GameState from this one without copying any cards.
+
+        The new state shares every pile (list) with this one. A move then
+        replaces just the piles it changes with new lists, so nothing that
+        this state can see is ever modified. That's a lot cheaper than a
+        deepcopy() of the whole game, but it means that the piles of a
+        GameState must never be modified in place once it has children! Use
+        deepcopy() first if you need to do that.
+
+        The moves also update the hash from the parent's if the parent's was
+        already worked out, by XORing out the keys of the cards that moved
+        and XORing in their new ones.
+        """
+        new_state = GameState.__new__(GameState)
+        new_state.tableau = list(self.tableau)
+        new_state.stock = self.stock
+        new_state.waste = self.waste
+        new_state.foundation = list(self.foundation)
+        new_state.rules = self.rules
+        new_state.redeals = self.redeals
+        new_state._hash = self._hash
+        new_state._key = None
+        new_state._tops = self._tops
+        return new_state
+
+    def __deepcopy__(self, memo):
+        # cards never need copying. Whoever wants a deep copy is probably
+        # going to change it, so don't keep the hash or key either
+        new_state = GameState.__new__(GameState)
+        new_state.tableau = [
+            [list(face_down), list(face_up)]
+            for face_down, face_up in self.tableau]
+        new_state.stock = list(self.stock)
+        new_state.waste = list(self.waste)
+        new_state.foundation = list(self.foundation)
+        new_state.rules = self.rules
+        new_state.redeals = self.redeals
+        new_state._hash = None
+        new_state._key = None
+        new_state._tops = None
+        return new_state
+
+    def _set_column(self, col, face_down, face_up):
+        """
+        Replace a column of a new state, flipping over the top face-down card
+        if there are no face-up cards left.
+        """
+        if len(face_up) == 0 and len(face_down) > 0:
+            card = face_down[-1]
+            face_down = face_down[:-1]
+            face_up = [card]
+            if self._hash is not None:
+                below = _top_index(face_down, ())
+                self._hash ^= (
+                    _ZOBRIST_TABLEAU[0][below][card.index]
+                    ^ _ZOBRIST_TABLEAU[1][below][card.index])
+
+        self.tableau[col] = [face_down, face_up]
 
     def turn_stock(self):
-        new_state = deepcopy(self)
+        new_state = self._child()
+        stock = self.stock
+        waste = self.waste
 
         # Do we need to move the waste pile back onto the stock?
-        if len(new_state.stock) == 0:
-            new_state.stock = list(reversed(new_state.waste))
-            new_state.waste = []
-
-        # move up to three cards from the stock onto the waste pile
-        for _ in range(min(3, len(new_state.stock))):
-            new_state.waste.append(new_state.stock.pop())
+        if len(stock) == 0:
+            limit = self.rules.redeals
+            if limit is not None:
+                if self.redeals >= limit or len(waste) == 0:
+                    raise InvalidMove("Can't turn the waste over again")
+                new_state.redeals = self.redeals + 1
+                if new_state._hash is not None:
+                    new_state._hash ^= (
+                        _ZOBRIST_REDEALS[self.redeals]
+                        ^ _ZOBRIST_REDEALS[self.redeals + 1])
+
+            stock = list(reversed(waste))
+            waste = []
+            if new_state._hash is not None:
+                new_state._hash ^= (
+                    _zobrist_pile(_ZOBRIST_WASTE, self.waste)
+                    ^ _zobrist_pile(_ZOBRIST_STOCK, stock))
+
+        # move up to three cards (or however many the rules say) from the
+        # stock onto the waste pile
+        count = min(self.rules.draw, len(stock))
+        turned = stock[len(stock) - count:][::-1]
+        new_state.waste = waste + turned
+        new_state.stock = stock[:len(stock) - count]
+
+        if new_state._hash is not None:
+            new_state._hash ^= (
+                _zobrist_pile(_ZOBRIST_STOCK, turned[::-1], len(stock) - count)
+                ^ _zobrist_pile(_ZOBRIST_WASTE, turned, len(waste)))
 
         return new_state
 
@@ -251,21 +617,26 @@ class GameState(object):
             if under.rank != 12:
                 raise InvalidMove("Only Kings can be moved to empty columns")
 
-        new_state = deepcopy(self)
+        new_state = self._child()
+        source_down, source_up = self.tableau[source_col]
+        target_down, target_up = self.tableau[target_col]
+        cards_to_move = source_up[source_row:]
 
-        # add to new column
-        cards_to_move = new_state.tableau[source_col][1][source_row:]
-        new_state.tableau[target_col][1].extend(cards_to_move)
+        # only the bottom card of the stack is sitting on something new
+        if new_state._hash is not None:
+            keys = _ZOBRIST_TABLEAU[1]
+            old_below = _top_index(source_down, source_up[:source_row])
+            new_below = _top_index(target_down, target_up)
+            new_state._hash ^= (
+                keys[old_below][under.index] ^ keys[new_below][under.index])
 
-        # remove from old column
-        cards_left = new_state.tableau[source_col][1][:source_row]
-        new_state.tableau[source_col][1] = cards_left
+        # add to new column
+        new_state.tableau[target_col] = [target_down, target_up + cards_to_move]
 
-        # if source column is now empty, we can flip a card
-        if len(new_state.tableau[source_col][1]) == 0:
-            if len(new_state.tableau[source_col][0]) > 0:
-                flipped = new_state.tableau[source_col][0].pop()
-                new_state.tableau[source_col][1].append(flipped)
+        # remove from old column, and if source column is now empty, we can
+        # flip a card
+        new_state._set_column(source_col, source_down, source_up[:source_row])
+        new_state._update_tops(self, (source_col, target_col))
 
         return new_state
 
@@ -277,19 +648,23 @@ class GameState(object):
             raise InvalidMove("{} foundation only goes up to {}".format(
                 card.suit, self.foundation[card.suit]))
 
-        new_state = deepcopy(self)
-
-        # remove the card from the tableau
-        new_state.tableau[source_col][1].pop()
+        new_state = self._child()
+        face_down, face_up = self.tableau[source_col]
 
         # increment this cards suit in the foundation
-        new_state.foundation[card.suit] += 1
+        count = self.foundation[card.suit]
+        new_state.foundation[card.suit] = count + 1
 
-        # flip a new card over in the tableau if it just got exposed
-        if len(new_state.tableau[source_col][1]) == 0:
-            if len(new_state.tableau[source_col][0]) > 0:
-                flipped = new_state.tableau[source_col][0].pop()
-                new_state.tableau[source_col][1].append(flipped)
+        if new_state._hash is not None:
+            new_state._hash ^= (
+                _ZOBRIST_TABLEAU[1][_top_index(face_down, face_up[:-1])][card.index]
+                ^ _ZOBRIST_FOUNDATION[card.suit][count]
+                ^ _ZOBRIST_FOUNDATION[card.suit][count + 1])
+
+        # remove the card from the tableau, flipping a new card over in the
+        # tableau if it just got exposed
+        new_state._set_column(source_col, face_down, face_up[:-1])
+        new_state._update_tops(self, (source_col,))
 
         return new_state
 
@@ -310,17 +685,27 @@ class GameState(object):
             if under.rank != 12:
                 raise InvalidMove("Only Kings can be moved to empty columns")
 
-        new_state = deepcopy(self)        
+        new_state = self._child()
 
         # pop from the waste
-        card = new_state.waste.pop()
+        new_state.waste = self.waste[:-1]
 
         # put it in the tableau
-        new_state.tableau[target_col][1].append(card)
+        face_down, face_up = self.tableau[target_col]
+        new_state.tableau[target_col] = [face_down, face_up + [under]]
+        new_state._update_tops(self, (target_col,))
+
+        if new_state._hash is not None:
+            new_state._hash ^= (
+                _ZOBRIST_WASTE[len(self.waste) - 1][under.index]
+                ^ _ZOBRIST_TABLEAU[1][_top_index(face_down, face_up)][under.index])
 
         return new_state
 
     def move_foundation_to_tableau(self, source_suit, target_col):
+        if not self.rules.foundation_to_tableau:
+            raise InvalidMove("Cards can't come back off the foundation")
+
         # is there a card here?
         if self.foundation[source_suit] == 0:
             raise InvalidMove(
@@ -340,29 +725,45 @@ class GameState(object):
             if card.rank != 12:
                 raise InvalidMove("Only Kings can be moved to empty columns")
 
-        new_state = deepcopy(self)
+        new_state = self._child()
 
         # remove it from the foundation
-        new_state.foundation[source_suit] -= 1
+        count = self.foundation[source_suit]
+        new_state.foundation[source_suit] = count - 1
 
         # put it in the tableau
-        new_state.tableau[target_col][1].append(card)
+        face_down, face_up = self.tableau[target_col]
+        new_state.tableau[target_col] = [face_down, face_up + [card]]
+        new_state._update_tops(self, (target_col,))
+
+        if new_state._hash is not None:
+            new_state._hash ^= (
+                _ZOBRIST_FOUNDATION[source_suit][count]
+                ^ _ZOBRIST_FOUNDATION[source_suit][count - 1]
+                ^ _ZOBRIST_TABLEAU[1][_top_index(face_down, face_up)][card.index])
 
         return new_state
 
     def move_waste_to_foundation(self):
-        new_state = deepcopy(self)
-
-        if len(new_state.waste) == 0:
+        if len(self.waste) == 0:
             raise InvalidMove
 
         # does this card fit on the foundation for its suit?
-        card = new_state.waste[-1]
-        if card.rank != new_state.foundation[card.suit]:
+        card = self.waste[-1]
+        count = self.foundation[card.suit]
+        if card.rank != count:
             raise InvalidMove
 
-        new_state.waste.pop()
-        new_state.foundation[card.suit] += 1
+        new_state = self._child()
+        new_state.waste = self.waste[:-1]
+        new_state.foundation[card.suit] = count + 1
+
+        if new_state._hash is not None:
+            new_state._hash ^= (
+                _ZOBRIST_WASTE[len(self.waste) - 1][card.index]
+                ^ _ZOBRIST_FOUNDATION[card.suit][count]
+                ^ _ZOBRIST_FOUNDATION[card.suit][count + 1])
+
         return new_state
 
     def apply_move(self, move):
@@ -385,30 +786,290 @@ class GameState(object):
         elif isinstance(move, MoveFoundationToTableau):
             return self.move_foundation_to_tableau(
                 move.source_col, move.target_col)
+        elif isinstance(move, MoveFromStock):
+            state = self
+            for _ in range(move.turns):
+                state = state.turn_stock()
+            return state.apply_move(move.move)
         else:
             raise InvalidMove(
                 'GameState.apply_move does not know how to do "{}"'.format(
                     move))
 
+    def _check_target(self, card, target_col):
+        """
+        Raise InvalidMove unless card can go on the end of target_col.
+        """
+        face_up = self.tableau[target_col][1]
+        if face_up:
+            if not card.fits_under(face_up[-1]):
+                raise InvalidMove(
+                    "{} doesn't fit under {} in the tableau!".format(
+                        card, face_up[-1]))
+        elif card.rank != 12:
+            raise InvalidMove("Only Kings can be moved to empty columns")
+
+    def do_move(self, move):
+        """
+        Make move on this state itself, instead of returning a new one like
+        apply_move(), and return a token that undo() takes to put it back
+        exactly how it was. Raises InvalidMove, without changing anything, if
+        the move isn't possible.
+
+        This changes the piles in place, so it must only be used on a state
+        that doesn't share them with any other- see _child(). deepcopy() a
+        state before the first do_move(). Any children made with
+        apply_move() since the last do_move() have to be thrown away too.
+
+        The hash, key and top card index are forgotten, and worked out again
+        if they're needed, so a search that moves back and forth on one
+        state this way doesn't have to make any new GameStates or piles.
+        """
+        token = (move, self._hash, self._key, self._tops, self.redeals)
+        info = self._do_move(move)
+        self._hash = None
+        self._key = None
+        self._tops = None
+        return token + (info,)
+
+    def _flip(self, col):
+        """
+        Turn over the top face-down card of col if that's the only kind of
+        card left in it. Returns whether it did.
+        """
+        face_down, face_up = self.tableau[col]
+        if face_down and not face_up:
+            face_up.append(face_down.pop())
+            return True
+        return False
+
+    def _do_move(self, move):
+        """
+        The part of do_move() that moves the cards. Returns what else undo()
+        needs to know.
+        """
+        if isinstance(move, TurnStock):
+            stock, waste = self.stock, self.waste
+            redealt = not stock
+            if redealt:
+                limit = self.rules.redeals
+                if limit is not None:
+                    if self.redeals >= limit or not waste:
+                        raise InvalidMove("Can't turn the waste over again")
+                    self.redeals += 1
+                waste.reverse()
+                stock.extend(waste)
+                del waste[:]
+            count = min(self.rules.draw, len(stock))
+            for _ in range(count):
+                waste.append(stock.pop())
+            return redealt, count
+
+        if isinstance(move, MoveTableauToTableau):
+            face_up = self.tableau[move.source_col][1]
+            if move.source_row >= len(face_up):
+                raise InvalidMove(
+                    "There's no cards in column {}".format(move.source_col))
+            self._check_target(face_up[move.source_row], move.target_col)
+            count = len(face_up) - move.source_row
+            self.tableau[move.target_col][1].extend(face_up[move.source_row:])
+            del face_up[move.source_row:]
+            return self._flip(move.source_col), count
+
+        if isinstance(move, MoveTableauToFoundation):
+            face_up = self.tableau[move.source_col][1]
+            if not face_up:
+                raise InvalidMove(
+                    "There's no cards in column {}".format(move.source_col))
+            card = face_up[-1]
+            if self.foundation[card.suit] != card.rank:
+                raise InvalidMove("{} foundation only goes up to {}".format(
+                    card.suit, self.foundation[card.suit]))
+            face_up.pop()
+            self.foundation[card.suit] += 1
+            return self._flip(move.source_col), card
+
+        if isinstance(move, MoveWasteToTableau):
+            if not self.waste:
+                raise InvalidMove("The waste is empty")
+            self._check_target(self.waste[-1], move.target_col)
+            self.tableau[move.target_col][1].append(self.waste.pop())
+            return None
+
+        if isinstance(move, MoveWasteToFoundation):
+            if not self.waste:
+                raise InvalidMove("The waste is empty")
+            card = self.waste[-1]
+            if self.foundation[card.suit] != card.rank:
+                raise InvalidMove
+            self.waste.pop()
+            self.foundation[card.suit] += 1
+            return card
+
+        if isinstance(move, MoveFoundationToTableau):
+            if not self.rules.foundation_to_tableau:
+                raise InvalidMove("Cards can't come back off the foundation")
+            count = self.foundation[move.source_col]
+            if count == 0:
+                raise InvalidMove(
+                    "There is nothing in the foundation for {}".format(
+                        SUITS[move.source_col]))
+            card = _CARDS[move.source_col * 13 + count - 1]
+            self._check_target(card, move.target_col)
+            self.foundation[move.source_col] = count - 1
+            self.tableau[move.target_col][1].append(card)
+            return None
+
+        if isinstance(move, MoveFromStock):
+            tokens = []
+            try:
+                for _ in range(move.turns):
+                    tokens.append(self.do_move(_TURN_STOCK))
+                tokens.append(self.do_move(move.move))
+            except InvalidMove:
+                for token in reversed(tokens):
+                    self.undo(token)
+                raise
+            return tokens
+
+        raise InvalidMove(
+            'GameState.do_move does not know how to do "{}"'.format(move))
+
+    def undo(self, token):
+        """
+        Take back the move do_move() returned token for. Moves have to be
+        undone in the opposite order to the one they were made in.
+        """
+        move, hash_, key, tops, redeals, info = token
+
+        if isinstance(move, TurnStock):
+            redealt, count = info
+            stock, waste = self.stock, self.waste
+            for _ in range(count):
+                stock.append(waste.pop())
+            if redealt:
+                stock.reverse()
+                waste.extend(stock)
+                del stock[:]
+
+        elif isinstance(move, MoveTableauToTableau):
+            flipped, count = info
+            face_down, face_up = self.tableau[move.source_col]
+            if flipped:
+                face_down.append(face_up.pop())
+            target_up = self.tableau[move.target_col][1]
+            face_up.extend(target_up[-count:])
+            del target_up[-count:]
+
+        elif isinstance(move, MoveTableauToFoundation):
+            flipped, card = info
+            face_down, face_up = self.tableau[move.source_col]
+            if flipped:
+                face_down.append(face_up.pop())
+            face_up.append(card)
+            self.foundation[card.suit] -= 1
+
+        elif isinstance(move, MoveWasteToTableau):
+            self.waste.append(self.tableau[move.target_col][1].pop())
+
+        elif isinstance(move, MoveWasteToFoundation):
+            self.waste.append(info)
+            self.foundation[info.suit] -= 1
+
+        elif isinstance(move, MoveFoundationToTableau):
+            self.tableau[move.target_col][1].pop()
+            self.foundation[move.source_col] += 1
+
+        elif isinstance(move, MoveFromStock):
+            for sub_token in reversed(info):
+                self.undo(sub_token)
+
+        self.redeals = redeals
+        self._hash = hash_
+        self._key = key
+        self._tops = tops
+
     def is_won(self):
         return (self.foundation == [13, 13, 13, 13])
 
+    def key(self):
+        """
+        Return bytes that identify this game state exactly, for telling
+        whether we've been here before.
+
+        This is pack() with one change: practically, it doesn't matter what
+        order columns are in. Sorting the tableau columns means solve() won't
+        try to construct every possible arrangement of the same stacks of
+        cards just in different columns. Two states have the same key if and
+        only if they're the same game with the columns shuffled around.
+        """
+        if self._key is None:
+            self._key = self._make_key()
+        return self._key
+
+    def _make_key(self):
+        packed = bytearray(self.foundation)
+        for pile in (self.stock, self.waste):
+            packed.append(len(pile))
+            packed.extend(card.index for card in pile)
+
+        columns = []
+        for face_down, face_up in self.tableau:
+            column = bytearray((len(face_down), len(face_up)))
+            column.extend(card.index for card in face_down)
+            column.extend(card.index for card in face_up)
+            columns.append(bytes(column))
+
+        for column in sorted(columns):
+            packed.extend(column)
+        if self.rules.redeals is not None:
+            packed.append(self.redeals)
+        return bytes(packed)
+
+    def zobrist(self):
+        """
+        Return a 64 bit Zobrist hash of this state.
+
+        Every card has a random 64 bit key for each place it could be- each
+        position in the stock and in the waste, and in the tableau, face-down
+        or face-up on top of each other card or at the bottom of a column-
+        and every foundation count (and number of redeals, if the rules
+        limit them) has one too. The hash is all the keys for
+        where things are XORed together. Only what each card is sitting on
+        matters, not which column it's in, so like key() this doesn't depend
+        on the order of the columns.
+
+        The hash is worked out the first time it's needed, and after that
+        each move updates it from its parent's in time proportional to the
+        number of cards that moved. Moving a stack between columns only
+        changes what its bottom card sits on, so that's just one key.
+        """
+        if self._hash is None:
+            hash_ = 0
+            for suit, count in enumerate(self.foundation):
+                hash_ ^= _ZOBRIST_FOUNDATION[suit][count]
+            hash_ ^= _zobrist_pile(_ZOBRIST_STOCK, self.stock)
+            hash_ ^= _zobrist_pile(_ZOBRIST_WASTE, self.waste)
+            if self.rules.redeals is not None:
+                hash_ ^= _ZOBRIST_REDEALS[self.redeals]
+            for face_down, face_up in self.tableau:
+                below = _BOTTOM
+                for is_face_up, cards in enumerate((face_down, face_up)):
+                    keys = _ZOBRIST_TABLEAU[is_face_up]
+                    for card in cards:
+                        hash_ ^= keys[below][card.index]
+                        below = card.index
+            self._hash = hash_
+
+        return self._hash
+
     def __hash__(self):
-        # this may be a terrible idea, but:
-        # practically, it doesn't matter what order columns are in. Sorting the
-        # tableau columns before hashing means solve() won't try to construct
-        # every possible arrangement of the same stacks of cards just in
-        # different columns. BUT this kind of abuses what hashing is :-/
-        tableau_cols = [
-            tuple(tuple(stack) for stack in col) for col in self.tableau]
-        tableau_tuple = tuple(sorted(tableau_cols))
-
-        return hash((
-            tableau_tuple, tuple(self.stock), tuple(self.waste),
-            tuple(self.foundation)))
+        return self.zobrist()
 
     def __eq__(self, other_game_state):
-        return hash(self) == hash(other_game_state)
+        if not isinstance(other_game_state, GameState):
+            return NotImplemented
+        return self.key() == other_game_state.key()
 
 
 class Move(object):
@@ -542,66 +1203,1707 @@ class MoveFoundationToTableau(Move):
             self.source_col, self.target_col)
 
 
-def deal_random_game():
-    deck = deepcopy(DECK)
-    shuffle(deck)
-    return GameState(deck)
+class MoveFromStock(Move):
+    """
+    Turn the stock some number of times and then play the card that ends up
+    on top of the waste- move is a MoveWasteToTableau or
+    MoveWasteToFoundation. A search that uses these instead of TurnStock
+    doesn't have to go through every way the cards can be split between the
+    stock and the waste on the way.
+    """
+    def __init__(self, turns, move):
+        self.turns = turns
+        self.move = move
 
+    def expand(self):
+        """
+        The same thing as a list of ordinary moves.
+        """
+        return [_TURN_STOCK] * self.turns + [self.move]
+
+    def __hash__(self):
+        return hash((self.turns, self.move))
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, MoveFromStock)
+            and self.turns == other.turns and self.move == other.move)
 
-def solve(game_state, visited=None, depth=0):
+    def __repr__(self):
+        return "MoveFromStock({}, {!r})".format(self.turns, self.move)
+
+
+def expand_moves(moves):
     """
-    Return a sequence of moves that solves the game, or None if there is no
-    solution.
+    Turn any MoveFromStocks in moves into ordinary moves.
     """
-    global CACHE, CACHE_HITS
-    global MAXDEPTH
-    
-    if hash(game_state) in CACHE:
-        CACHE_HITS += 1
-        return CACHE[hash(game_state)]
+    expanded = []
+    for move in moves:
+        if isinstance(move, MoveFromStock):
+            expanded.extend(move.expand())
+        else:
+            expanded.append(move)
+    return expanded
+
+
+# the arguments each kind of move is made with, in order
+MOVE_ARGUMENTS = {
+    TurnStock: (),
+    MoveTableauToTableau: ("source_col", "source_row", "target_col"),
+    MoveTableauToFoundation: ("source_col",),
+    MoveWasteToTableau: ("target_col",),
+    MoveWasteToFoundation: (),
+    MoveFoundationToTableau: ("source_col", "target_col"),
+}
+MOVE_TYPES = dict(
+    (move_type.__name__, move_type) for move_type in MOVE_ARGUMENTS)
 
-    if depth > MAXDEPTH:
-        MAXDEPTH = depth
 
-    # DEBUG
-    if visited is not None:
-        if len(visited) % 100 == 0:
-            print("at depth {}, visited {} states, maxdepth = {}".format(depth, len(visited), MAXDEPTH))
+def move_to_list(move):
+    """
+    Return a move as [class name, arguments...], which JSON can handle.
+    """
+    arguments = MOVE_ARGUMENTS[type(move)]
+    return [type(move).__name__] + [getattr(move, name) for name in arguments]
+
 
-    # if this is a new game, start tracking what game states we've tried
-    if visited == None:
-        visited = set()
+def move_from_list(move):
+    """
+    The opposite of move_to_list().
+    """
+    try:
+        move_type = MOVE_TYPES[move[0]]
+    except (KeyError, IndexError, TypeError):
+        raise ValueError("not a move: {!r}".format(move))
+    return move_type(*move[1:])
+
+
+# Every move valid_moves() can return, made once up front
+_TURN_STOCK = TurnStock()
+_WASTE_TO_FOUNDATION = MoveWasteToFoundation()
+_TABLEAU_TO_FOUNDATION = [MoveTableauToFoundation(col) for col in range(7)]
+_WASTE_TO_TABLEAU = [MoveWasteToTableau(col) for col in range(7)]
+_TABLEAU_TO_TABLEAU = [
+    [[MoveTableauToTableau(col, row, target_col) for target_col in range(7)]
+     for row in range(52)]
+    for col in range(7)]
+_FOUNDATION_TO_TABLEAU = [
+    [MoveFoundationToTableau(suit, col) for col in range(7)]
+    for suit in range(4)]
+
+
+def _targets(card, tops, empty):
+    """
+    The columns card can go on, in order, given the index of top cards from
+    GameState._make_tops() and a list of the empty columns.
+    """
+    if card.rank == 12:
+        return empty
+
+    targets = [
+        tops[index] for index in _FITS_UNDER[card.index] if index in tops]
+    if len(targets) == 2 and targets[0] > targets[1]:
+        targets.reverse()
+    return targets
+
+
+def deal_random_game(rng=None, rules=DEFAULT_RULES):
+    """
+    Shuffle a deck and deal it. Pass a random.Random as rng to get the same
+    deal every time for the same seed.
+    """
+    deck = list(DECK)
+    if rng is None:
+        shuffle(deck)
+    else:
+        rng.shuffle(deck)
+    return GameState(deck, rules)
+
+
+def deck_to_string(deck):
+    """
+    Write out a deck (a list of cards in the order GameState deals them) as
+    the indexes of its cards separated by spaces.
+    """
+    return " ".join(str(card.index) for card in deck)
+
+
+def deck_from_string(text):
+    """
+    Read a deck written by deck_to_string()
+    """
+    try:
+        deck = [Card.from_index(int(word)) for word in text.split()]
+    except (ValueError, IndexError):
+        raise ValueError("Not a deck of cards: {!r}".format(text))
+
+    if len(set(deck)) != 52 or len(deck) != 52:
+        raise ValueError("A deck needs each of the 52 cards exactly once")
+    return deck
+
+
+WON = "won"
+LOST = "lost"
+
+
+def _column_bottoms(game_state):
+    """
+    The index of the bottom card of each column, or None for an empty one.
+    No two columns can have the same bottom card, so in states with the same
+    key() these say which column is which.
+    """
+    return tuple(
+        (face_down or face_up)[0].index if face_down or face_up else None
+        for face_down, face_up in game_state.tableau)
+
+
+def _renumber_move(move, bottoms, game_state):
+    """
+    Take a move made in a state whose columns had the given bottom cards,
+    and return the same move in game_state, which has the same columns but
+    maybe in a different order.
+    """
+    new_bottoms = _column_bottoms(game_state)
+    if new_bottoms == bottoms:
+        return move
+
+    empty = [col for col, index in enumerate(new_bottoms) if index is None]
+    columns = []
+    for index in bottoms:
+        if index is None:
+            columns.append(empty.pop())
+        else:
+            columns.append(new_bottoms.index(index))
+
+    if isinstance(move, MoveTableauToTableau):
+        return MoveTableauToTableau(
+            columns[move.source_col], move.source_row,
+            columns[move.target_col])
+    if isinstance(move, MoveTableauToFoundation):
+        return MoveTableauToFoundation(columns[move.source_col])
+    if isinstance(move, MoveWasteToTableau):
+        return MoveWasteToTableau(columns[move.target_col])
+    if isinstance(move, MoveFoundationToTableau):
+        return MoveFoundationToTableau(
+            move.source_col, columns[move.target_col])
+    if isinstance(move, MoveFromStock):
+        return MoveFromStock(
+            move.turns, _renumber_move(move.move, bottoms, game_state))
+    return move
+
+
+class TranspositionTable(object):
+    """
+    Remembers which game states have been proven won or lost, so a search
+    never has to work them out twice.
+
+    A won state is stored with the move to make from it, and solution()
+    follows those moves to the end. A lost state is one where every move was
+    tried and none of them led to a win. That's only a proof if none of those
+    moves were skipped for leading back to a state the search was already in
+    the middle of, so the search has to be careful what it calls lost!
+
+    States are stored by key(), which doesn't care what order the columns
+    are in, but moves do. So a won state is stored along with the bottom card
+    of each of its columns, and lookup() renumbers the move's columns to
+    match the state being looked up.
+
+    The table holds at most max_entries states (each takes roughly 250
+    bytes). Once it's full, storing a new state evicts the one that was least
+    recently stored or looked up.
+    """
+    def __init__(self, max_entries=1000000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.evictions = 0
+
+    def lookup(self, game_state):
+        """
+        Return (WON, move) or (LOST, None) for a state we know about, or None.
+        """
+        key = game_state.key()
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        if entry[0] == WON:
+            return WON, _renumber_move(entry[1], entry[2], game_state)
+        return entry
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def store_won(self, game_state, move):
+        self._store(
+            game_state.key(), (WON, move, _column_bottoms(game_state)))
+
+    def store_lost(self, game_state):
+        self._store(game_state.key(), (LOST, None))
+
+    def store_lost_key(self, key):
+        self._store(key, (LOST, None))
+
+    def solution(self, game_state):
+        """
+        Follow the stored moves from a won game_state to the end of the game.
+        Returns None if part of the way has been evicted.
+        """
+        moves = []
+        while not game_state.is_won():
+            entry = self.entries.get(game_state.key())
+            if entry is None or entry[0] != WON:
+                return None
+            move = _renumber_move(entry[1], entry[2], game_state)
+            moves.append(move)
+            game_state = game_state.apply_move(move)
+        return moves
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class VisitedSet(object):
+    """
+    The game states a search has already been to, by their exact key().
+    """
+    # a search that has visited everything it can without winning has proved
+    # the game can't be won
+    exact = True
+
+    def __init__(self):
+        self.keys = set()
+
+    def visit(self, game_state):
+        """
+        Mark game_state as visited. Returns False if it already was.
+        """
+        key = game_state.key()
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def __contains__(self, game_state):
+        return game_state.key() in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class FingerprintSet(object):
+    """
+    A stand-in for VisitedSet that uses less memory and time.
 
-    # If we've already been to this game state up a number of frames of
-    # recursion, don't bother (but also don't cache this as a loss)
-    if hash(game_state) in visited:
+    Instead of each state's key it stores a fingerprint: the low `bits` bits
+    of the state's zobrist() hash. Two different states with the same
+    fingerprint look like the same state, and the second one will never be
+    searched, so this can make solve() miss a solution. expected_collisions()
+    says how likely that was.
+    """
+    exact = False
+
+    def __init__(self, bits=64):
+        if not 1 <= bits <= 64:
+            raise ValueError("bits must be from 1 to 64")
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.fingerprints = set()
+
+    def visit(self, game_state):
+        fingerprint = game_state.zobrist() & self.mask
+        if fingerprint in self.fingerprints:
+            return False
+        self.fingerprints.add(fingerprint)
+        return True
+
+    def __contains__(self, game_state):
+        return game_state.zobrist() & self.mask in self.fingerprints
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def expected_collisions(self):
+        """
+        Expected number of pairs of states so far that had the same
+        fingerprint (the birthday bound). If this is much less than 1 it's
+        very unlikely any state was wrongly skipped.
+        """
+        count = len(self.fingerprints)
+        return count * (count - 1) / 2 / 2 ** self.bits
+
+
+class DiskVisitedSet(object):
+    """
+    A VisitedSet that keeps most of its keys on disk, for searches that
+    would otherwise run out of memory- which is just when it matters that
+    the set is exact, so the search can prove the game lost.
+
+    The newest memory_keys keys are kept in memory. When there are more
+    than that they're sorted and written out to a file (a run) in
+    directory (a new temporary directory by default), and looked up by
+    binary search through the memory-mapped file. Whenever there are
+    max_runs runs they're merged into one, so a lookup never has to look
+    through many. A Bloom filter of bloom_bits bits in memory says when a
+    key definitely isn't on disk, which is most of the time in a search
+    that's going somewhere new, so those lookups don't touch the disk at
+    all. It only gets less useful as it fills up, never wrong.
+
+    This only bounds the visited states. The search still keeps the states
+    on its path, and the keys of the ones that might still be part of a
+    group it hasn't finished (see DepthFirstSearch), in memory, and the
+    table holds at most its max_entries.
+
+    close() deletes the files (the temporary directory too, if it made one).
+    """
+    exact = True
+
+    # each key on disk is its length and then the key, padded out to the
+    # longest a key can be, so the records can be found by position
+    RECORD_SIZE = 74
+
+    # how many bits of the Bloom filter each key sets
+    BLOOM_HASHES = 3
+
+    def __init__(
+            self, directory=None, memory_keys=1000000, max_runs=8,
+            bloom_bits=1 << 27):
+        self.own_directory = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="solitaire-visited-")
+        self.directory = directory
+        self.memory_keys = memory_keys
+        self.max_runs = max_runs
+        self.keys = set()
+        self.bloom = bytearray(bloom_bits // 8)
+        self.bloom_bits = len(self.bloom) * 8
+        # (file, mmap, number of records) for each run
+        self.runs = []
+        self.count = 0
+        self.files_written = 0
+
+    def _record(self, key):
+        return bytes((len(key),)) + key.ljust(self.RECORD_SIZE - 1, b"\0")
+
+    def _bloom_positions(self, record):
+        # hash() of bytes is random from one process to the next, but the
+        # filter never leaves this one
+        mask = 0xffffffffffffffff
+        first = hash(record) & mask
+        # double hashing: the other positions step on from the first by a
+        # second hash, made by mixing up the first one's bits (the finalizer
+        # from splitmix64), and odd so that it's never 0
+        second = first
+        second = ((second ^ (second >> 30)) * 0xbf58476d1ce4e5b9) & mask
+        second = ((second ^ (second >> 27)) * 0x94d049bb133111eb) & mask
+        second = second ^ (second >> 31) | 1
+        bits = self.bloom_bits
+        return [
+            (first + number * second) % bits
+            for number in range(self.BLOOM_HASHES)]
+
+    def _on_disk(self, record):
+        bloom = self.bloom
+        for position in self._bloom_positions(record):
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return False
+
+        size = self.RECORD_SIZE
+        for _, data, length in self.runs:
+            low, high = 0, length
+            while low < high:
+                middle = (low + high) // 2
+                start = middle * size
+                found = data[start:start + size]
+                if found < record:
+                    low = middle + 1
+                elif found > record:
+                    high = middle
+                else:
+                    return True
+        return False
+
+    def _write_run(self, records):
+        """
+        Write sorted records to a new run file and map it.
+        """
+        path = os.path.join(
+            self.directory, "run-{}".format(self.files_written))
+        self.files_written += 1
+        length = 0
+        with open(path, "wb") as run_file:
+            for record in records:
+                run_file.write(record)
+                length += 1
+        run_file = open(path, "rb")
+        data = mmap.mmap(run_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.runs.append((run_file, data, length))
+
+    def _close_run(self, run):
+        run_file, data, _ = run
+        data.close()
+        run_file.close()
+        os.remove(run_file.name)
+
+    def _read_run(self, run):
+        _, data, length = run
+        size = self.RECORD_SIZE
+        for start in range(0, length * size, size):
+            yield data[start:start + size]
+
+    def _spill(self):
+        """
+        Move the keys in memory out to a new run, merging all the runs into
+        one if there are too many.
+        """
+        records = sorted(self._record(key) for key in self.keys)
+        bloom = self.bloom
+        for record in records:
+            for position in self._bloom_positions(record):
+                bloom[position >> 3] |= 1 << (position & 7)
+        self._write_run(records)
+        self.keys = set()
+
+        if len(self.runs) >= self.max_runs:
+            runs = self.runs
+            self.runs = []
+            self._write_run(merge(*[self._read_run(run) for run in runs]))
+            for run in runs:
+                self._close_run(run)
+
+    def visit(self, game_state):
+        """
+        Mark game_state as visited. Returns False if it already was.
+        """
+        key = game_state.key()
+        if key in self.keys or self._on_disk(self._record(key)):
+            return False
+        self.keys.add(key)
+        self.count += 1
+        if len(self.keys) >= self.memory_keys:
+            self._spill()
+        return True
+
+    def __contains__(self, game_state):
+        key = game_state.key()
+        return key in self.keys or self._on_disk(self._record(key))
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        for run in self.runs:
+            self._close_run(run)
+        self.runs = []
+        if self.own_directory and os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+    def __del__(self):
+        self.close()
+
+
+class SearchStats(object):
+    """
+    How a search is going: how many states it has visited (nodes), how many
+    moves deep the current path is (depth) and the deepest it's been
+    (max_depth), transposition table hits and misses, and the average number
+    of moves from each state it has expanded (branching_factor- for
+    DepthFirstSearch, which only works out moves as it needs them, that's
+    the number it has got through so far).
+    """
+    def __init__(
+            self, nodes, depth, max_depth, tt_hits, tt_misses,
+            branching_factor):
+        self.nodes = nodes
+        self.depth = depth
+        self.max_depth = max_depth
+        self.tt_hits = tt_hits
+        self.tt_misses = tt_misses
+        self.branching_factor = branching_factor
+
+    def as_dict(self):
+        return dict(
+            nodes=self.nodes, depth=self.depth, max_depth=self.max_depth,
+            tt_hits=self.tt_hits, tt_misses=self.tt_misses,
+            branching_factor=self.branching_factor)
+
+    def __str__(self):
+        return (
+            "visited {} states, at depth {}, max depth {}, {} table hits, "
+            "branching factor {:.2f}".format(
+                self.nodes, self.depth, self.max_depth, self.tt_hits,
+                self.branching_factor))
+
+
+def foundation_first(game_state, macros=False):
+    """
+    The move ordering iter_moves() already uses: moves onto the foundation,
+    then from the waste, then around the tableau, turning the stock, and
+    finally taking cards back off the foundation.
+
+    A move ordering is any function that takes a game state (and macros,
+    to pass on to iter_moves()) and returns an iterable of all its valid
+    moves, in the order a search should try them.
+    """
+    return game_state.iter_moves(macros)
+
+
+def uncovers_card(game_state, move):
+    """
+    Does move turn over a face-down card in the tableau?
+    """
+    if isinstance(move, MoveTableauToTableau):
+        return (
+            move.source_row == 0
+            and len(game_state.tableau[move.source_col][0]) > 0)
+    if isinstance(move, MoveTableauToFoundation):
+        face_down, face_up = game_state.tableau[move.source_col]
+        return len(face_up) == 1 and len(face_down) > 0
+    return False
+
+
+def uncover_first(game_state, macros=False):
+    """
+    Move ordering that tries moves that turn over face-down cards first,
+    then everything else in the usual order.
+    """
+    rest = []
+    for move in game_state.iter_moves(macros):
+        if uncovers_card(game_state, move):
+            yield move
+        else:
+            rest.append(move)
+    for move in rest:
+        yield move
+
+
+def safe_for_foundation(card, foundation):
+    """
+    Can card go onto the foundation (with counts foundation) without it ever
+    being worth having it back in the tableau?
+
+    A card in the tableau is only any use for holding the next lower cards
+    of the other color. Once those are both on the foundation nothing needs
+    it- as long as they never need to come back down either, for holding the
+    cards below them, so the other suit of this card's color has to be
+    nearly as far along too. Aces and 2s are always safe.
+    """
+    rank = card.rank
+    if rank <= 1:
+        return True
+    suit = card.suit
+    return (
+        foundation[(suit + 1) % 4] >= rank
+        and foundation[(suit + 3) % 4] >= rank
+        and foundation[(suit + 2) % 4] >= rank - 1)
+
+
+def pruned_moves(game_state, ordering=foundation_first, macros=False):
+    """
+    The moves from game_state worth trying, in the order given by ordering.
+
+    If a card can safely go onto the foundation (see safe_for_foundation())
+    that's the only move- any way to win from here still works after making
+    it. Otherwise it's every move except ones that can't get anywhere new:
+
+    - moving a king that's already at the bottom of a column, with nothing
+      under it, to an empty column (the columns' order doesn't matter)
+    - taking a card off the foundation that would be safe to put straight
+      back on it
+    """
+    foundation = game_state.foundation
+    for col, (_, face_up) in enumerate(game_state.tableau):
+        if face_up:
+            card = face_up[-1]
+            if (
+                    card.rank == foundation[card.suit]
+                    and safe_for_foundation(card, foundation)):
+                yield _TABLEAU_TO_FOUNDATION[col]
+                return
+    if game_state.waste:
+        card = game_state.waste[-1]
+        if (
+                card.rank == foundation[card.suit]
+                and safe_for_foundation(card, foundation)):
+            yield _WASTE_TO_FOUNDATION
+            return
+
+    for move in ordering(game_state, macros):
+        if isinstance(move, MoveTableauToTableau):
+            if move.source_row == 0 and not game_state.tableau[
+                    move.source_col][0]:
+                if not game_state.tableau[move.target_col][1]:
+                    continue
+        elif isinstance(move, MoveFoundationToTableau):
+            card = _CARDS[
+                move.source_col * 13 + foundation[move.source_col] - 1]
+            if safe_for_foundation(card, foundation):
+                continue
+        yield move
+
+
+class LearnedOrdering(object):
+    """
+    Move ordering that learns from solved games which kinds of move tend to
+    be the right ones.
+
+    A move's kind is its class and whether it turns over a face-down card.
+    train() goes through a solution counting, for each kind, how often a
+    move of that kind was possible and how often it was the one played.
+    Moves are then tried in order of that ratio (with one win and one loss
+    thrown in so that kinds never seen don't come out at 0 or 1), and in the
+    usual order among moves of the same kind.
+    """
+    def __init__(self):
+        # kind -> [times played, times possible]
+        self.counts = dict()
+
+    def train(self, game_state, moves):
+        """
+        Learn from moves, a solution to game_state.
+        """
+        for move in moves:
+            for possible in game_state.iter_moves():
+                kind = self.kind(game_state, possible)
+                self.counts.setdefault(kind, [0, 0])[1] += 1
+            self.counts.setdefault(self.kind(game_state, move), [0, 0])[0] += 1
+            game_state = game_state.apply_move(move)
+
+    @staticmethod
+    def kind(game_state, move):
+        return type(move).__name__, uncovers_card(game_state, move)
+
+    def score(self, kind):
+        played, possible = self.counts.get(kind, (0, 0))
+        return (played + 1) / (possible + 2)
+
+    def __call__(self, game_state, macros=False):
+        scores = dict()
+        moves = []
+        for move in game_state.iter_moves(macros):
+            kind = self.kind(game_state, move)
+            if kind not in scores:
+                scores[kind] = self.score(kind)
+            moves.append((-scores[kind], len(moves), move))
+        moves.sort()
+        return [move for _, _, move in moves]
+
+
+class DepthFirstSearch(object):
+    """
+    Non-recursive version of the depth-first search solve() used to do.
+
+    Instead of recursing once per move, this keeps an explicit stack of
+    frames, one per move on the current path, so the search can be stopped
+    after any number of nodes and picked up again later by calling run()
+    again. Each frame is a list of
+
+        [game_state, moves, last_move, number, lowest, certain]
+
+    where moves is an iterator over the moves still to try from game_state,
+    in the order given by ordering (foundation_first() by default; see
+    there), and last_move is the one being tried at the moment. With prune
+    (the default) only the moves pruned_moves() allows are tried. With
+    macros, MoveFromStock takes the place of TurnStock (see
+    GameState.iter_moves()), and solution is in terms of those.
+
+    visited keeps track of every state tried so far. By default it's a
+    VisitedSet, but anything with the same visit(), len() and exact will do,
+    like a FingerprintSet, or a DiskVisitedSet for searches too big to keep
+    track of in memory.
+
+    table is a TranspositionTable that wins and losses get recorded in (a
+    new one by default). Pass the same table to another search to reuse what
+    this one proved. tt_hits and tt_misses count lookups in it by this search.
+
+    progress, if given, gets called with a SearchStats every sample_interval
+    nodes, to keep an eye on how things are going.
+
+    Proving a loss is the tricky part, because a move that leads back to a
+    state further up the current path gets skipped, and that state hasn't
+    been proven lost yet. So this keeps track of groups of states that can
+    all reach each other (strongly connected components, found the way
+    Tarjan's algorithm does- that's what number and lowest are for), and
+    only records them as lost once the search has backed out of the whole
+    group having tried everything. certain is False if a move was skipped
+    for some other reason (the state was visited before but has since been
+    evicted from the table, or a FingerprintSet collision), and then nothing
+    depending on it gets recorded as lost at all.
+    """
+    def __init__(
+            self, game_state, visited=None, table=None, progress=None,
+            sample_interval=10000, ordering=foundation_first, prune=True,
+            macros=False):
+        if visited is None:
+            visited = VisitedSet()
+        if table is None:
+            table = TranspositionTable()
+
+        self.visited = visited
+        self.table = table
+        self.ordering = ordering
+        self.prune = prune
+        self.macros = macros
+        self.stack = []
+        self.solution = None
+        self.lost = False
+        self.nodes = 0
+        self.tt_hits = 0
+        self.tt_misses = 0
+        self.max_depth = 0
+        self.expanded = 0
+        self.moves_generated = 0
+
+        self.progress = progress
+        self.sample_interval = sample_interval
+        self.next_sample = sample_interval
+        if progress is None:
+            self.next_sample = float("inf")
+
+        # keys of states whose group isn't finished yet, in the order they
+        # were visited, and the numbers they were given
+        self.unfinished = []
+        self.numbers = dict()
+
+        self.visited.visit(game_state)
+        if game_state.is_won():
+            self.solution = []
+            return
+
+        entry = self._lookup(game_state)
+        if entry is None:
+            self._push(game_state)
+        elif entry[0] == WON:
+            self.solution = entry[1]
+        else:
+            self.lost = True
+
+    @property
+    def finished(self):
+        return not self.stack
+
+    def path(self):
+        """
+        The moves that lead from the starting state to the top of the stack.
+        """
+        return [frame[2] for frame in self.stack]
+
+    def _lookup(self, game_state):
+        """
+        Return (WON, the moves from game_state to the end) or (LOST, None)
+        if the table knows about game_state, or None.
+        """
+        entry = self.table.lookup(game_state)
+        if entry is not None and entry[0] == WON:
+            # part of the way to the win could have been evicted (or, with a
+            # table shared between processes, changed), so follow it now and
+            # hang on to what we find
+            solution = self.table.solution(game_state)
+            entry = None if solution is None else (WON, solution)
+        if entry is None:
+            self.tt_misses += 1
+        else:
+            self.tt_hits += 1
+        return entry
+
+    def _push(self, game_state):
+        number = len(self.numbers)
+        key = game_state.key()
+        self.numbers[key] = number
+        self.unfinished.append(key)
+
+        if self.prune:
+            moves = pruned_moves(game_state, self.ordering, self.macros)
+        else:
+            moves = iter(self.ordering(game_state, self.macros))
+        self.expanded += 1
+        self.stack.append([game_state, moves, None, number, number, True])
+        if len(self.stack) - 1 > self.max_depth:
+            self.max_depth = len(self.stack) - 1
+
+    def sample(self):
+        """
+        Return a SearchStats for where the search is at right now.
+        """
+        return SearchStats(
+            self.nodes, max(len(self.stack) - 1, 0), self.max_depth, self.tt_hits,
+            self.tt_misses,
+            self.moves_generated / self.expanded if self.expanded else 0.0)
+
+    def _pop(self):
+        """
+        Every move from the state on top of the stack has been tried.
+        """
+        number, lowest, certain = self.stack.pop()[3:6]
+
+        if lowest == number:
+            # This state is the first one visited of a group that can all
+            # reach each other, and we've now tried everything in the group
+            # and every move out of it. None of them won, so they're all lost.
+            while True:
+                key = self.unfinished.pop()
+                if certain:
+                    self.table.store_lost_key(key)
+                if self.numbers.pop(key) == number:
+                    break
+
+            if not self.stack:
+                # That was the starting state. It's lost if we know that
+                # everything reachable from it was lost.
+                self.lost = certain or self.visited.exact
+            elif not certain:
+                self.stack[-1][5] = False
+
+        elif self.stack:
+            # This state can get back to a state further up the stack, so it
+            # belongs to the same group and we'll find out when that's done.
+            parent = self.stack[-1]
+            parent[4] = min(parent[4], lowest)
+            parent[5] = parent[5] and certain
+
+    def _won(self, rest_of_moves):
+        """
+        The game state on top of the stack can be won with rest_of_moves.
+        Record the win for every state on the way there and stop searching.
+        """
+        for frame in self.stack:
+            self.table.store_won(frame[0], frame[2])
+        self.solution = self.path() + rest_of_moves
+        del self.stack[:]
+
+    def run(self, max_nodes=None):
+        """
+        Search until the game is solved, every reachable state has been
+        tried, or max_nodes new states have been visited. Returns True if the
+        search is finished (check self.solution, or self.lost to see if the
+        game was proven unwinnable), False if it stopped early and can be
+        resumed.
+        """
+        visited = self.visited
+        table = self.table
+        stack = self.stack
+        nodes_at_start = self.nodes
+
+        while stack:
+            if max_nodes is not None and self.nodes - nodes_at_start >= max_nodes:
+                return False
+
+            frame = stack[-1]
+            move = next(frame[1], None)
+
+            # tried everything from here- backtrack
+            if move is None:
+                self._pop()
+                continue
+
+            frame[2] = move
+            self.moves_generated += 1
+            new_state = frame[0].apply_move(move)
+
+            if new_state.is_won():
+                self.nodes += 1
+                self._won([])
+                return True
+
+            entry = self._lookup(new_state)
+            if entry is not None:
+                if entry[0] == WON:
+                    self._won(entry[1])
+                    return True
+                continue
+
+            # If we've already been to this game state, don't bother
+            if not visited.visit(new_state):
+                number = self.numbers.get(new_state.key())
+                if number is None:
+                    frame[5] = False
+                else:
+                    frame[4] = min(frame[4], number)
+                continue
+
+            self.nodes += 1
+            self._push(new_state)
+
+            if self.nodes >= self.next_sample:
+                self.next_sample = self.nodes + self.sample_interval
+                self.progress(self.sample())
+
+        return True
+
+
+class InPlaceDepthFirstSearch(DepthFirstSearch):
+    """
+    DepthFirstSearch that makes and takes back moves on one copy of the
+    starting state with GameState.do_move() and undo(), instead of making a
+    new GameState for every move. It tries the same moves in the same order,
+    so it finds the same solution after visiting the same states.
+
+    Each frame has the token for undoing the move that led to it on the
+    end. The moves are still worked out lazily: by the time a frame's
+    iterator is asked for its next move, every move made below it has been
+    undone, so the state it's looking at is exactly the one it started on.
+    """
+    def __init__(
+            self, game_state, visited=None, table=None, progress=None,
+            sample_interval=10000, ordering=foundation_first, prune=True,
+            macros=False):
+        self.start = game_state
+        self.state = deepcopy(game_state)
+        super(InPlaceDepthFirstSearch, self).__init__(
+            self.state, visited, table, progress, sample_interval, ordering,
+            prune, macros)
+
+    def _push(self, game_state, token=None):
+        super(InPlaceDepthFirstSearch, self)._push(game_state)
+        self.stack[-1].append(token)
+
+    def _pop(self):
+        token = self.stack[-1][6]
+        super(InPlaceDepthFirstSearch, self)._pop()
+        if token is not None:
+            self.state.undo(token)
+
+    def _won(self, rest_of_moves):
+        # the frames all have the same state, so play the moves again to
+        # find the ones to record
+        game_state = self.start
+        for frame in self.stack:
+            self.table.store_won(game_state, frame[2])
+            game_state = game_state.apply_move(frame[2])
+        self.solution = self.path() + rest_of_moves
+        del self.stack[:]
+
+    def run(self, max_nodes=None):
+        """
+        The same as DepthFirstSearch.run().
+        """
+        visited = self.visited
+        table = self.table
+        stack = self.stack
+        state = self.state
+        nodes_at_start = self.nodes
+
+        while stack:
+            if max_nodes is not None and self.nodes - nodes_at_start >= max_nodes:
+                return False
+
+            frame = stack[-1]
+            move = next(frame[1], None)
+
+            # tried everything from here- backtrack
+            if move is None:
+                self._pop()
+                continue
+
+            frame[2] = move
+            self.moves_generated += 1
+            token = state.do_move(move)
+
+            if state.is_won():
+                self.nodes += 1
+                self._won([])
+                return True
+
+            entry = self._lookup(state)
+            if entry is not None:
+                if entry[0] == WON:
+                    self._won(entry[1])
+                    return True
+                state.undo(token)
+                continue
+
+            # If we've already been to this game state, don't bother
+            if not visited.visit(state):
+                number = self.numbers.get(state.key())
+                state.undo(token)
+                if number is None:
+                    frame[5] = False
+                else:
+                    frame[4] = min(frame[4], number)
+                continue
+
+            self.nodes += 1
+            self._push(state, token)
+
+            if self.nodes >= self.next_sample:
+                self.next_sample = self.nodes + self.sample_interval
+                self.progress(self.sample())
+
+        return True
+
+
+def minimum_moves_left(game_state):
+    """
+    A lower bound on how many moves it takes to win from game_state, for A*
+    search. Every card that isn't on the foundation has to be moved there,
+    one move each, and if there are cards in the stock it has to be turned at
+    least once to get at them.
+    """
+    moves = 52 - sum(game_state.foundation)
+    if game_state.stock:
+        moves += 1
+    return moves
+
+
+def estimated_moves_left(game_state):
+    """
+    A guess at how far game_state is from a win, for best-first search. It
+    counts cards not on the foundation, face-down cards in the tableau, and
+    blocked cards: ones sitting on top of a lower card of the same suit in
+    their column, which will have to move again before that card can go up.
+    This isn't a lower bound, so solutions found with it won't be the
+    shortest.
+    """
+    estimate = 52 - sum(game_state.foundation)
+    for face_down, face_up in game_state.tableau:
+        estimate += len(face_down)
+
+        lowest = [13, 13, 13, 13]
+        for cards in (face_down, face_up):
+            for card in cards:
+                if card.rank > lowest[card.suit]:
+                    estimate += 1
+                else:
+                    lowest[card.suit] = card.rank
+
+    return estimate
+
+
+class BestFirstSearch(object):
+    """
+    Search that always carries on from the most promising state found so far,
+    rather than the most recent one like DepthFirstSearch.
+
+    How promising a state is comes from heuristic(state), an estimate of how
+    many moves are left, plus path_cost times the number of moves made to get
+    there. With path_cost=0 that's greedy best-first search, which usually
+    finds a (long) solution quickly. With path_cost=1 and a heuristic that
+    never overestimates, like minimum_moves_left(), it's A*, and the first
+    solution it finds is as short as possible.
+
+    It has the same run(), finished, solution, lost and sample() as
+    DepthFirstSearch. Children the table knows are lost get skipped, and with
+    path_cost=0 a child the table knows is won finishes the search straight
+    away. A* doesn't take that shortcut, since the stored way to win might
+    not be the shortest. Wins get recorded in the table, but losses don't,
+    because this doesn't keep track of enough to prove individual states
+    lost.
+    """
+    def __init__(
+            self, game_state, heuristic=estimated_moves_left, path_cost=0,
+            visited=None, table=None, progress=None, sample_interval=10000):
+        if visited is None:
+            visited = VisitedSet()
+        if table is None:
+            table = TranspositionTable()
+
+        self.start = game_state
+        self.heuristic = heuristic
+        self.path_cost = path_cost
+        self.visited = visited
+        self.table = table
+        self.solution = None
+        self.lost = False
+        self.nodes = 0
+        self.tt_hits = 0
+        self.tt_misses = 0
+        self.max_depth = 0
+        self.depth = 0
+        self.moves_generated = 0
+
+        self.progress = progress
+        self.sample_interval = sample_interval
+        self.next_sample = sample_interval
+        if progress is None:
+            self.next_sample = float("inf")
+
+        # Heap of (priority, -moves made, tiebreaker, game_state, path) where
+        # path is (last move, path before that), or None for the start. On a
+        # tie the state furthest from the start goes first.
+        self.frontier = []
+        self.pushed = 0
+
+        if game_state.is_won():
+            self.solution = []
+        else:
+            self._push(game_state, 0, None)
+
+    @property
+    def finished(self):
+        return not self.frontier
+
+    def _push(self, game_state, moves_made, path):
+        priority = self.heuristic(game_state) + self.path_cost * moves_made
+        heappush(
+            self.frontier,
+            (priority, -moves_made, self.pushed, game_state, path))
+        self.pushed += 1
+
+    def _lookup(self, game_state):
+        # the same as DepthFirstSearch._lookup()
+        entry = self.table.lookup(game_state)
+        if entry is not None and entry[0] == WON:
+            solution = self.table.solution(game_state)
+            entry = None if solution is None else (WON, solution)
+        if entry is None:
+            self.tt_misses += 1
+        else:
+            self.tt_hits += 1
+        return entry
+
+    def _won(self, path, rest_of_moves=()):
+        moves = []
+        while path is not None:
+            move, path = path
+            moves.append(move)
+        moves.reverse()
+
+        # record the win for every state along the way
+        game_state = self.start
+        states = []
+        for move in moves:
+            states.append(game_state)
+            game_state = game_state.apply_move(move)
+        for state, move in zip(states, moves):
+            self.table.store_won(state, move)
+
+        self.solution = moves + list(rest_of_moves)
+        del self.frontier[:]
+
+    def sample(self):
+        return SearchStats(
+            self.nodes, self.depth, self.max_depth, self.tt_hits,
+            self.tt_misses,
+            self.moves_generated / self.nodes if self.nodes else 0.0)
+
+    def run(self, max_nodes=None):
+        """
+        Search until the game is solved, every reachable state has been
+        tried, or max_nodes states have been expanded. Returns True if the
+        search is finished, False if it stopped early and can be resumed.
+        """
+        frontier = self.frontier
+        nodes_at_start = self.nodes
+
+        while frontier:
+            if max_nodes is not None and self.nodes - nodes_at_start >= max_nodes:
+                return False
+
+            _, moves_made, _, game_state, path = heappop(frontier)
+            moves_made = -moves_made
+            if not self.visited.visit(game_state):
+                continue
+
+            self.nodes += 1
+            self.depth = moves_made
+            if moves_made > self.max_depth:
+                self.max_depth = moves_made
+
+            if self.nodes >= self.next_sample:
+                self.next_sample = self.nodes + self.sample_interval
+                self.progress(self.sample())
+
+            moves = game_state.valid_moves()
+            self.moves_generated += len(moves)
+            for move in moves:
+                new_state = game_state.apply_move(move)
+                if new_state.is_won():
+                    self._won((move, path))
+                    return True
+
+                entry = self._lookup(new_state)
+                if entry is not None:
+                    if entry[0] == LOST:
+                        continue
+                    if not self.path_cost:
+                        self._won((move, path), entry[1])
+                        return True
+
+                if new_state not in self.visited:
+                    self._push(new_state, moves_made + 1, (move, path))
+
+        self.lost = self.solution is None and self.visited.exact
+        return True
+
+
+class BeamSearch(BestFirstSearch):
+    """
+    Breadth-first search that only keeps the width most promising states of
+    each layer, as scored by heuristic (lower is better), and throws the rest
+    away. It takes about width times the length of the solution states to
+    find a win, so it's quick, but it can miss one: if the beam runs out
+    that only proves the game is lost if nothing was ever thrown away.
+
+    prune and macros are the same as for DepthFirstSearch, and help a lot
+    here: every move uses up a layer, so it's well worth not spending them
+    on turning the stock or on moves that pruned_moves() would skip.
+    Otherwise it works like BestFirstSearch with path_cost=0, including what
+    gets stored in the table.
+    """
+    def __init__(
+            self, game_state, width=100, heuristic=estimated_moves_left,
+            visited=None, table=None, progress=None, sample_interval=10000,
+            prune=True, macros=False):
+        self.width = width
+        self.prune = prune
+        self.macros = macros
+        # children found for the next layer, as (score, tiebreaker,
+        # game_state, path), and whether any layer had states thrown away
+        self.next_layer = []
+        self.dropped = False
+        super(BeamSearch, self).__init__(
+            game_state, heuristic, 0, visited, table, progress,
+            sample_interval)
+        self._next_layer()
+
+    @property
+    def finished(self):
+        return not self.frontier and not self.next_layer
+
+    def _push(self, game_state, moves_made, path):
+        self.next_layer.append(
+            (self.heuristic(game_state), self.pushed, game_state, path))
+        self.pushed += 1
+
+    def _next_layer(self):
+        """
+        Make the best of the next layer the frontier, best last. The same
+        state can turn up more than once in a layer, so only keep it once.
+        """
+        layer = []
+        keys = set()
+        for child in sorted(self.next_layer):
+            key = child[2].key()
+            if key not in keys:
+                keys.add(key)
+                layer.append(child)
+        if len(layer) > self.width:
+            self.dropped = True
+            del layer[self.width:]
+        layer.reverse()
+        self.frontier = layer
+        self.next_layer = []
+
+    def _won(self, path, rest_of_moves=()):
+        super(BeamSearch, self)._won(path, rest_of_moves)
+        del self.next_layer[:]
+
+    def run(self, max_nodes=None):
+        """
+        Search until the game is solved, the beam runs out, or max_nodes
+        states have been expanded. Returns True if the search is finished,
+        False if it stopped early and can be resumed.
+        """
+        nodes_at_start = self.nodes
+
+        while not self.finished:
+            if not self.frontier:
+                self._next_layer()
+                self.depth += 1
+            if max_nodes is not None and self.nodes - nodes_at_start >= max_nodes:
+                return False
+
+            _, _, game_state, path = self.frontier.pop()
+            if not self.visited.visit(game_state):
+                continue
+
+            self.nodes += 1
+            if self.depth > self.max_depth:
+                self.max_depth = self.depth
+
+            if self.nodes >= self.next_sample:
+                self.next_sample = self.nodes + self.sample_interval
+                self.progress(self.sample())
+
+            if self.prune:
+                moves = list(pruned_moves(
+                    game_state, foundation_first, self.macros))
+            else:
+                moves = game_state.valid_moves(self.macros)
+            self.moves_generated += len(moves)
+            for move in moves:
+                new_state = game_state.apply_move(move)
+                if new_state.is_won():
+                    self._won((move, path))
+                    return True
+
+                entry = self._lookup(new_state)
+                if entry is not None:
+                    if entry[0] == LOST:
+                        continue
+                    self._won((move, path), entry[1])
+                    return True
+
+                if new_state not in self.visited:
+                    self._push(new_state, self.depth + 1, (move, path))
+
+        self.lost = (
+            self.solution is None and not self.dropped and self.visited.exact)
+        return True
+
+
+UNKNOWN = "unknown"
+
+# Ways solve() can search
+DEPTH_FIRST = "depth-first"
+BEST_FIRST = "best-first"
+A_STAR = "a-star"
+BEAM = "beam"
+
+# how many nodes solve() searches between checks of its time and memory
+# budgets
+BUDGET_CHECK_NODES = 1000
+
+
+class SolveResult(object):
+    """
+    What solve() found out: status is WON (and moves is a list of moves that
+    win the game), LOST (there's no way to win), or UNKNOWN (a budget ran
+    out first, and exhausted says which one: "nodes", "seconds" or
+    "memory"- or "visited" if the search tried everything with a visited
+    set that isn't exact, so it can't be sure, or "beam" if a beam search
+    ran out after throwing states away).
+
+    stats is a dict of how much work it took: seconds, plus everything in
+    SearchStats.as_dict().
+    """
+    def __init__(self, status, moves=None, exhausted=None, stats=None):
+        self.status = status
+        self.moves = moves
+        self.exhausted = exhausted
+        self.stats = stats if stats is not None else dict()
+
+    def __repr__(self):
+        return "SolveResult({!r}, {!r}, {!r}, {!r})".format(
+            self.status, self.moves, self.exhausted, self.stats)
+
+
+def memory_in_use():
+    """
+    How many bytes of memory this process is using right now, or None if we
+    can't tell on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    # this is the most we've ever used, not what we're using now, but it's
+    # better than nothing
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _accelerated_search(game_state, prune):
+    """
+    An accel.AcceleratedSearch, or None if that's not possible.
+    """
+    try:
+        import accel
+    except ImportError:
+        return None
+    if not accel.available:
+        return None
+    try:
+        return accel.AcceleratedSearch(game_state, prune)
+    except ValueError:
         return None
 
-    # Otherwise: we haven't tried this game state until just now. Mark it as
-    # visited before trying to solve from here.
-    visited.add(hash(game_state))
-    
-    # base case: game is won. No moves necessary!
-    if game_state.is_won():
-        # CACHE[game_state] = []
-        return []
-
-    for move in game_state.valid_moves():
-        rest_of_moves = solve(game_state.apply_move(move), visited, depth + 1)
-        if rest_of_moves is not None:
-            solution = [move] + rest_of_moves
-            # CACHE[game_state] = solution
-            return solution
-
-    # if we get here, we did not find a way to win this game!
-    # CACHE[game_state] = None
+
+def _run_search(search, start, max_nodes, max_seconds, max_memory):
+    """
+    Run search until it's finished or one of solve()'s budgets runs out,
+    counting nodes from where the search is now and seconds from start.
+    Returns which budget ran out, or None.
+    """
+    nodes_at_start = search.nodes
+    while not search.finished:
+        nodes = BUDGET_CHECK_NODES
+        if max_nodes is not None:
+            nodes = min(nodes, max_nodes - (search.nodes - nodes_at_start))
+            if nodes <= 0:
+                return "nodes"
+        if max_seconds is not None and time.time() - start >= max_seconds:
+            return "seconds"
+        if max_memory is not None:
+            memory = memory_in_use()
+            if memory is not None and memory > max_memory:
+                return "memory"
+        search.run(max_nodes=nodes)
     return None
 
 
+def _search_result(search, exhausted, start):
+    """
+    The SolveResult for a search that _run_search() has stopped.
+    """
+    if search.solution is not None:
+        status = WON
+    elif search.lost:
+        status = LOST
+    else:
+        status = UNKNOWN
+        beam_dropped = isinstance(search, BeamSearch) and search.dropped
+        if exhausted is None and beam_dropped:
+            # the beam ran out, but it threw states away on the way
+            exhausted = "beam"
+        elif exhausted is None:
+            # visited everything, but that doesn't prove anything if visited
+            # might have skipped states
+            exhausted = "visited"
+
+    moves = search.solution
+    if moves is not None:
+        moves = expand_moves(moves)
+
+    stats = search.sample().as_dict()
+    stats["seconds"] = time.time() - start
+    return SolveResult(status, moves, exhausted, stats)
+
+
+def solve(
+        game_state, visited=None, table=None, max_nodes=None,
+        max_seconds=None, max_memory=None, progress=None,
+        sample_interval=10000, strategy=DEPTH_FIRST,
+        ordering=foundation_first, prune=True, macros=False,
+        accelerate=True, heuristic=None, beam_width=100, escalate=False,
+        in_place=False, processes=None):
+    """
+    Try to find a sequence of moves that solves the game, and return a
+    SolveResult.
+
+    strategy picks how to search: DEPTH_FIRST is the default and uses the
+    least memory, BEST_FIRST usually finds a solution fastest but a long
+    one, and A_STAR finds the shortest solution there is but can take a lot
+    longer. BEAM only keeps the beam_width best states at each depth, so
+    it's quicker still but can come back UNKNOWN when there is a way to win;
+    with escalate, it falls back on a depth-first search (with whatever is
+    left of the budgets) when that happens. See BestFirstSearch and
+    BeamSearch. heuristic scores states for all of those, and defaults to
+    minimum_moves_left() for A_STAR and estimated_moves_left() for the
+    others. ordering is the move ordering for
+    depth-first search, like foundation_first(), uncover_first() or a
+    trained LearnedOrdering, and prune says whether to skip moves that
+    pruned_moves() says aren't worth it. With macros, depth-first search
+    turns the stock and plays a card from it as one move (see
+    MoveFromStock), which cuts out a lot of states that only differ in
+    where the stock and waste are split. The moves in the result are always
+    ordinary ones.
+
+    The search gives up, with an UNKNOWN result, after visiting max_nodes
+    states, after max_seconds seconds, or once the process is using more than
+    max_memory bytes, if any of those are given. Time and memory are checked
+    every BUDGET_CHECK_NODES states.
+
+    See DepthFirstSearch for what visited and table can be, and for how
+    progress gets called.
+
+    A plain depth-first search- no visited, table or progress, and the
+    default ordering without macros- runs in C if the accel module could be
+    built (see there), unless accelerate is False. Otherwise, with in_place
+    it moves back and forth on one copy of game_state instead of making a
+    new state for every move (see InPlaceDepthFirstSearch). It finds the
+    same solution every way.
+
+    With processes, a depth-first search is shared out between that many
+    worker processes instead (see parallel.parallel_solve()), and the
+    solution found can be a different one. table can only be a
+    parallel.SharedTranspositionTable then, and the other strategies,
+    visited, progress and max_memory raise ValueError.
+    """
+    if processes is not None:
+        import parallel
+        if strategy != DEPTH_FIRST:
+            raise ValueError(
+                "only depth-first search can use processes, not {!r}".format(
+                    strategy))
+        if table is not None and not isinstance(
+                table, parallel.SharedTranspositionTable):
+            raise ValueError(
+                "searching with processes needs a SharedTranspositionTable")
+        for name, value in [
+                ("visited", visited), ("progress", progress),
+                ("max_memory", max_memory)]:
+            if value is not None:
+                raise ValueError(
+                    "{} can't be used when searching with processes".format(
+                        name))
+        return parallel.parallel_solve(
+            game_state, processes, max_nodes, max_seconds, ordering, prune,
+            macros, table)
+
+    start = time.time()
+    if strategy == DEPTH_FIRST:
+        search = None
+        if (
+                accelerate and visited is None and table is None
+                and progress is None and ordering is foundation_first
+                and not macros):
+            search = _accelerated_search(game_state, prune)
+        if search is None:
+            search_type = (
+                InPlaceDepthFirstSearch if in_place else DepthFirstSearch)
+            search = search_type(
+                game_state, visited, table, progress, sample_interval,
+                ordering, prune, macros)
+    elif strategy == BEST_FIRST:
+        search = BestFirstSearch(
+            game_state, heuristic or estimated_moves_left, 0, visited, table,
+            progress, sample_interval)
+    elif strategy == A_STAR:
+        search = BestFirstSearch(
+            game_state, heuristic or minimum_moves_left, 1, visited, table,
+            progress, sample_interval)
+    elif strategy == BEAM:
+        search = BeamSearch(
+            game_state, beam_width, heuristic or estimated_moves_left,
+            visited, table, progress, sample_interval, prune, macros)
+    else:
+        raise ValueError("unknown search strategy: {!r}".format(strategy))
+    exhausted = _run_search(search, start, max_nodes, max_seconds, max_memory)
+    result = _search_result(search, exhausted, start)
+
+    if escalate and strategy == BEAM and result.status == UNKNOWN and (
+            result.exhausted in ("beam", "visited")):
+        # the beam ran out without proving anything, so search properly with
+        # what's left of the budgets
+        if max_nodes is not None:
+            max_nodes -= search.nodes
+        if max_seconds is not None:
+            max_seconds -= result.stats["seconds"]
+        result = solve(
+            game_state, None, table, max_nodes, max_seconds, max_memory,
+            progress, sample_interval, DEPTH_FIRST, ordering, prune, macros,
+            accelerate)
+        result.stats["beam_nodes"] = search.nodes
+        result.stats["seconds"] = time.time() - start
+
+    return result
+
+
+class Solver(object):
+    """
+    Solves game after game with the same transposition table, for giving
+    hints while someone plays:
+
+        solver = Solver(max_seconds=0.1)
+        move = solver.hint(state)
+
+    Once a search finds a win, every state on the way to it is in the table,
+    so if the player follows the hint (or comes back to one of those states
+    with the columns in a different order) the next hint is just a lookup.
+    Losses the searches prove are kept too, which saves going down those
+    paths again after the player goes their own way.
+
+    If a search runs out of budget, it's kept, and carries on from where it
+    got to the next time it's asked about the same state.
+
+    Searches are depth-first, and ordering, prune, macros and accelerate are
+    the same as for solve(). The C search doesn't use the table, so it only
+    records the states on the way to a win (or the starting state if it's
+    lost) afterwards.
+    """
+    def __init__(
+            self, table=None, max_nodes=None, max_seconds=None,
+            max_memory=None, ordering=foundation_first, prune=True,
+            macros=False, accelerate=True):
+        if table is None:
+            table = TranspositionTable()
+        self.table = table
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.max_memory = max_memory
+        self.ordering = ordering
+        self.prune = prune
+        self.macros = macros
+        self.accelerate = accelerate
+
+        # the last search that ran out of budget, and the pack() of the state
+        # it started from
+        self.search = None
+        self.search_start = None
+
+    def _new_search(self, game_state):
+        if (
+                self.accelerate and self.ordering is foundation_first
+                and not self.macros):
+            search = _accelerated_search(game_state, self.prune)
+            if search is not None:
+                return search
+        return DepthFirstSearch(
+            game_state, table=self.table, ordering=self.ordering,
+            prune=self.prune, macros=self.macros)
+
+    def solve(self, game_state):
+        """
+        Like solve(game_state) with this solver's budgets, but using and
+        adding to what earlier calls found out.
+        """
+        start = time.time()
+        entry = self.table.lookup(game_state)
+        if entry is not None:
+            moves = None
+            if entry[0] == WON:
+                moves = self.table.solution(game_state)
+            if entry[0] == LOST or moves is not None:
+                stats = SearchStats(0, 0, 0, 1, 0, 0.0).as_dict()
+                stats["seconds"] = time.time() - start
+                if moves is None:
+                    return SolveResult(LOST, stats=stats)
+                return SolveResult(WON, expand_moves(moves), stats=stats)
+
+        packed = game_state.pack()
+        if packed == self.search_start:
+            search = self.search
+        else:
+            search = self._new_search(game_state)
+        exhausted = _run_search(
+            search, start, self.max_nodes, self.max_seconds, self.max_memory)
+
+        if search.finished:
+            self.search = self.search_start = None
+        else:
+            self.search = search
+            self.search_start = packed
+
+        if search.solution is not None:
+            for move in search.solution:
+                self.table.store_won(game_state, move)
+                game_state = game_state.apply_move(move)
+        elif search.lost:
+            self.table.store_lost(game_state)
+        return _search_result(search, exhausted, start)
+
+    def hint(self, game_state):
+        """
+        The next move to make to win from game_state, or None if there's no
+        way to win or the search ran out of budget before finding one.
+        """
+        # Following the stored moves all the way to the end, like solve()
+        # does to check the win, takes a lot longer than the lookup. If
+        # some of the way has been evicted, the next hint will find out.
+        entry = self.table.lookup(game_state)
+        if entry is not None and entry[0] == WON:
+            return expand_moves([entry[1]])[0]
+
+        result = self.solve(game_state)
+        if result.moves:
+            return result.moves[0]
+        return None
+
+
 if __name__ == "__main__":
-    sys.setrecursionlimit(10000)
-    deck = deepcopy(DECK)
+    deck = list(DECK)
     shuffle(deck)
     game = GameState(deck)
     print(game)
-    print(solve(game))
+    print(solve(game, progress=print).moves)
@@ -0,0 +1,152 @@
+"""
+Remember what solve() found out about deals from one run to the next, in a
+SQLite database file:
+
+    with SolutionDatabase("solutions.db") as database:
+        result = database.lookup(deck)
+        if result is None:
+            result = solve(GameState(deck))
+            database.store(deck, result)
+
+A deal can be given as the deck GameState() deals it from, or as the
+GameState it deals. Either way it's stored under the state's pack(), along
+with the rules, so the same deal played by different rules is a different
+entry. Moves are stored as JSON, in move_to_list() form.
+
+Writes are saved up and written batch_size at a time in one transaction,
+which is much quicker than one at a time, so close() the database (or use it
+in a with statement) to make sure the last of them get written. lookup()
+sees writes that are still waiting.
+
+A WON or LOST result is never replaced by an UNKNOWN one, so storing the
+result of a search that gave up can't lose anything.
+"""
+
+import json
+import sqlite3
+
+from solitaire import (
+    DEFAULT_RULES, UNKNOWN, GameState, SolveResult, move_from_list,
+    move_to_list)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS solutions (
+    deal BLOB NOT NULL,
+    rules TEXT NOT NULL,
+    status TEXT NOT NULL,
+    moves TEXT,
+    exhausted TEXT,
+    stats TEXT NOT NULL,
+    PRIMARY KEY (deal, rules)
+)
+"""
+
+# keep the old row if it's already known to be won or lost
+_STORE = """
+INSERT INTO solutions (deal, rules, status, moves, exhausted, stats)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (deal, rules) DO UPDATE SET
+    status = excluded.status, moves = excluded.moves,
+    exhausted = excluded.exhausted, stats = excluded.stats
+WHERE solutions.status = '{}' OR excluded.status != '{}'
+""".format(UNKNOWN, UNKNOWN)
+
+
+def deal_key(deal, rules=DEFAULT_RULES):
+    """
+    The key a deal (a deck, or the GameState dealt from it) is stored under.
+    """
+    if not isinstance(deal, GameState):
+        deal = GameState(deal, rules)
+    return deal.pack(), repr(deal.rules)
+
+
+class SolutionDatabase(object):
+    """
+    The results of solving deals, kept in a SQLite database at path (which
+    gets created if it doesn't exist). See the top of this module.
+    """
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(_SCHEMA)
+        self.connection.commit()
+        # rows waiting to be written, by key
+        self.pending = dict()
+
+    @staticmethod
+    def _row(key, result):
+        moves = None
+        if result.moves is not None:
+            moves = json.dumps(
+                [move_to_list(move) for move in result.moves])
+        return key + (
+            result.status, moves, result.exhausted, json.dumps(result.stats))
+
+    @staticmethod
+    def _result(row):
+        status, moves, exhausted, stats = row
+        if moves is not None:
+            moves = [move_from_list(move) for move in json.loads(moves)]
+        return SolveResult(status, moves, exhausted, json.loads(stats))
+
+    def store(self, deal, result, rules=DEFAULT_RULES):
+        """
+        Remember result (a SolveResult) for deal, played by rules if deal is
+        a deck.
+        """
+        key = deal_key(deal, rules)
+        waiting = self.pending.get(key)
+        if (
+                waiting is not None and waiting[2] != UNKNOWN
+                and result.status == UNKNOWN):
+            return
+        self.pending[key] = self._row(key, result)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def lookup(self, deal, rules=DEFAULT_RULES):
+        """
+        Return the SolveResult stored for deal, or None.
+        """
+        key = deal_key(deal, rules)
+        waiting = self.pending.get(key)
+        if waiting is not None and waiting[2] != UNKNOWN:
+            return self._result(waiting[2:])
+
+        row = self.connection.execute(
+            "SELECT status, moves, exhausted, stats FROM solutions "
+            "WHERE deal = ? AND rules = ?", key).fetchone()
+        if waiting is not None and (row is None or row[0] == UNKNOWN):
+            # a newer try that gave up too
+            row = waiting[2:]
+        if row is None:
+            return None
+        return self._result(row)
+
+    def flush(self):
+        """
+        Write everything store() has saved up.
+        """
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(_STORE, self.pending.values())
+        self.pending.clear()
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,6 +1,16 @@
+import os
+import tempfile
+from random import Random
+from unittest import SkipTest
+
 from nose.tools import *
 
 from solitaire import *
+import accel
+import batch
+import benchmark
+import parallel
+import solution_db
 
 
 # visible cards in example state are, from left to right:
@@ -21,6 +31,30 @@ _s = _s.apply_move(MoveTableauToTableau(4, 0, 0))
 empty_col_1_state = _s.apply_move(MoveTableauToTableau(1, 0, 4))
 
 
+def endgame_state(seed, lowest_rank):
+    """
+    Deal a shuffled deck, then put every card below lowest_rank on the
+    foundation so that there's only a small game left to solve.
+    """
+    state = deal_random_game(Random(seed))
+
+    for col in state.tableau:
+        col[0][:] = [card for card in col[0] if card.rank >= lowest_rank]
+        col[1][:] = [card for card in col[1] if card.rank >= lowest_rank]
+        if len(col[1]) == 0 and len(col[0]) > 0:
+            col[1].append(col[0].pop())
+
+    state.stock[:] = [card for card in state.stock if card.rank >= lowest_rank]
+    state.foundation = [lowest_rank] * 4
+    return state
+
+
+def play(state, moves):
+    for move in moves:
+        state = state.apply_move(move)
+    return state
+
+
 def test_empty_col_example_state():
     assert_list_equal(empty_col_1_state.tableau[1], [[], []])
 
@@ -104,6 +138,42 @@ def test_card_queen_of_hearts_repr_str():
     assert_equal(str(card), "Queen of Hearts")
 
 
+def test_card_is_interned():
+    for card in DECK:
+        assert_true(Card(card.rank, card.suit) is card)
+        assert_true(deepcopy(card) is card)
+
+
+def test_card_index():
+    for index, card in enumerate(DECK):
+        assert_equal(card.index, index)
+        assert_true(Card.from_index(index) is card)
+
+
+def test_card_out_of_range_raises_error():
+    with assert_raises(ValueError):
+        Card(13, 0)
+
+    with assert_raises(ValueError):
+        Card(0, -1)
+
+
+def test_game_state_pack_unpack():
+    state = example_state_1.apply_move(MoveTableauToTableau(1, 0, 4))
+    for _ in range(3):
+        state = state.apply_move(TurnStock())
+
+    packed = state.pack()
+    assert_equal(len(packed), 4 + 2 + 14 + 52)
+
+    unpacked = GameState.unpack(packed)
+    assert_list_equal(unpacked.tableau, state.tableau)
+    assert_list_equal(unpacked.stock, state.stock)
+    assert_list_equal(unpacked.waste, state.waste)
+    assert_list_equal(unpacked.foundation, state.foundation)
+    assert_equal(unpacked.pack(), packed)
+
+
 def test_game_state_move_one_card_tableau_to_tableau():
     # move column 1 Jack of Hearts onto column 4 Queen of Clubs
     state2 = example_state_1.move_tableau_to_tableau(1, 0, 4)
@@ -322,6 +392,31 @@ def test_cant_move_tableau_to_foundation_too_high():
             state.apply_move(move)
 
 
+def test_apply_move_does_not_change_original_state():
+    before = deepcopy(example_state_1)
+    state = example_state_1
+    for move in [
+            MoveTableauToTableau(1, 0, 4), MoveTableauToTableau(4, 0, 0),
+            TurnStock(), TurnStock()]:
+        state = state.apply_move(move)
+
+    assert_list_equal(example_state_1.tableau, before.tableau)
+    assert_list_equal(example_state_1.stock, before.stock)
+    assert_list_equal(example_state_1.waste, before.waste)
+    assert_list_equal(example_state_1.foundation, before.foundation)
+
+
+def test_apply_move_shares_untouched_piles():
+    state = example_state_1.apply_move(MoveTableauToTableau(1, 0, 4))
+
+    for col in [0, 2, 3, 5, 6]:
+        assert_true(state.tableau[col] is example_state_1.tableau[col])
+    assert_false(state.tableau[1] is example_state_1.tableau[1])
+    assert_false(state.tableau[4] is example_state_1.tableau[4])
+    assert_true(state.stock is example_state_1.stock)
+    assert_true(state.waste is example_state_1.waste)
+
+
 def test_game_state_turn_stock():
     state = example_state_1.turn_stock()
     assert_list_equal(
@@ -744,6 +839,10 @@ def test_valid_moves_moves_to_foundation():
     for _ in range(8):
         state = state.turn_stock()
 
+    # copy before changing cards in place, the tableau is shared with
+    # example_state_1
+    state = deepcopy(state)
+
     # make an ace accessible on col 6 of tableau
     state.tableau[6][0][4] = Card(11, 1)
     state.tableau[6][1][0] = Card(0, 2)
@@ -764,6 +863,10 @@ def test_valid_moves_foundation_to_tableau():
     # put ace of spades onto the foundation
     state.apply_move(MoveWasteToFoundation())
 
+    # copy before changing cards in place, the tableau is shared with
+    # example_state_1
+    state = deepcopy(state)
+
     # make 2 of hearts accessible in tableau col 3
     state.tableau[3][1][0] = Card(2, 3)
     state.tableau[4][0][0] = Card(3, 3)
@@ -777,15 +880,353 @@ def test_valid_moves_foundation_to_tableau():
 
 
 def test_card_hash():
-    raise NotImplementedError
+    hashes = set(hash(card) for card in DECK)
+    assert_equal(len(hashes), 52)
+    assert_equal(hash(Card(11, 3)), hash(Card(11, 3)))
 
 
 def test_game_state_hash():
-    raise NotImplementedError
+    state1 = example_state_1.apply_move(TurnStock())
+    state2 = example_state_1.apply_move(TurnStock())
+    assert_equal(hash(state1), hash(state2))
+    assert_equal(state1, state2)
+
+    state3 = state1.apply_move(TurnStock())
+    assert_not_equal(state1, state3)
 
 
 def test_game_state_hash_tableau_column_order():
-    raise NotImplementedError
+    state = deepcopy(example_state_1)
+    state.tableau[0], state.tableau[6] = state.tableau[6], state.tableau[0]
+    assert_equal(hash(state), hash(example_state_1))
+    assert_equal(state, example_state_1)
+    assert_equal(state.key(), example_state_1.key())
+
+
+def test_game_state_key_is_exact():
+    # the same cards, but one more of them face down
+    state = deepcopy(example_state_1)
+    state.tableau[6][1].insert(0, state.tableau[6][0].pop())
+    assert_not_equal(state.key(), example_state_1.key())
+    assert_not_equal(state, example_state_1)
+
+
+def test_game_state_not_equal_to_other_things():
+    assert_not_equal(example_state_1, None)
+    assert_not_equal(example_state_1, "example_state_1")
+
+
+def test_solve_with_fingerprint_set():
+    state = endgame_state(0, 8)
+    visited = FingerprintSet(bits=64)
+    result = solve(state, visited)
+    assert_equal(result.status, WON)
+    assert_list_equal(result.moves, solve(state).moves)
+    assert_true(len(visited) > 0)
+    assert_true(visited.expected_collisions() < 1e-9)
+
+
+def test_fingerprint_set_collisions():
+    # with only 8 bits, 1000 states can't all get their own fingerprint
+    visited = FingerprintSet(bits=8)
+    states = VisitedSet()
+    for seed in range(10):
+        for state in random_playout(example_state_1, seed, 100):
+            visited.visit(state)
+            states.visit(state)
+    assert_true(len(states) >= 500)
+    assert_true(len(visited) <= 256)
+    assert_true(visited.expected_collisions() > 1)
+
+
+def test_disk_visited_set():
+    states = []
+    for seed in range(3):
+        states.extend(random_playout(
+            deal_random_game(Random(seed)), seed, 300))
+    keys = set(state.key() for state in states)
+
+    visited = DiskVisitedSet(memory_keys=50, max_runs=3, bloom_bits=4096)
+    seen = set()
+    for state in states:
+        assert_equal(visited.visit(state), state.key() not in seen)
+        seen.add(state.key())
+    assert_equal(len(visited), len(keys))
+    assert_true(visited.files_written > visited.max_runs)
+    for state in states:
+        assert_in(state, visited)
+    assert_not_in(endgame_state(0, 5), visited)
+
+    directory = visited.directory
+    visited.close()
+    assert_false(os.path.exists(directory))
+
+
+def test_solve_with_disk_visited_set():
+    visited = DiskVisitedSet(memory_keys=100)
+    result = solve(endgame_state(3, 5), visited=visited)
+    assert_equal(result.status, WON)
+    assert_equal(solve(stuck_state(), visited=DiskVisitedSet()).status, LOST)
+    visited.close()
+
+
+def random_playout(state, seed, length):
+    rng = Random(seed)
+    states = [state]
+    for _ in range(length):
+        state = state.apply_move(rng.choice(state.valid_moves()))
+        states.append(state)
+    return states
+
+
+def test_do_move_and_undo():
+    for rules in [DEFAULT_RULES, Rules(draw=1, redeals=1)]:
+        for seed in range(5):
+            rng = Random(seed)
+            state = deal_random_game(rng, rules)
+            moving = deepcopy(state)
+            tokens = []
+            for _ in range(200):
+                macros = rng.random() < 0.5
+                move = rng.choice(state.valid_moves(macros))
+                before = (moving.pack(), moving.zobrist(), moving.key())
+                tokens.append((before, moving.do_move(move)))
+                state = state.apply_move(move)
+                assert_equal(moving.pack(), state.pack())
+                assert_equal(moving.zobrist(), state.zobrist())
+                assert_list_equal(moving.valid_moves(), state.valid_moves())
+
+            while tokens:
+                before, token = tokens.pop()
+                moving.undo(token)
+                assert_equal(
+                    (moving.pack(), moving.zobrist(), moving.key()), before)
+
+
+def test_do_invalid_move_changes_nothing():
+    state = GameState(DECK, Rules(redeals=0))
+    state.stock = []
+    packed = state.pack()
+    for move in [
+            TurnStock(), MoveWasteToFoundation(), MoveWasteToTableau(0),
+            MoveTableauToTableau(0, 0, 1), MoveFoundationToTableau(0, 0),
+            MoveFromStock(1, MoveWasteToFoundation())]:
+        assert_raises(InvalidMove, state.do_move, move)
+        assert_equal(state.pack(), packed)
+
+
+def test_in_place_search_matches():
+    for seed in range(5):
+        state = endgame_state(seed, 5)
+        for macros in [False, True]:
+            result = solve(state, macros=macros, accelerate=False)
+            in_place = solve(
+                state, macros=macros, accelerate=False, in_place=True)
+            assert_equal(in_place.moves, result.moves)
+            assert_equal(in_place.stats["nodes"], result.stats["nodes"])
+    assert_equal(solve(stuck_state(), in_place=True).status, LOST)
+
+
+def test_zobrist_incremental_matches_full():
+    for seed in range(10):
+        state = deal_random_game(Random(seed))
+        state.zobrist()
+
+        for state in random_playout(state, seed, 200):
+            assert_equal(state.zobrist(), deepcopy(state).zobrist())
+
+
+def test_valid_moves_incremental_matches_full():
+    # a copy works its index of column tops out from scratch
+    for seed in range(5):
+        state = deal_random_game(Random(seed))
+        for state in random_playout(state, seed, 200):
+            assert_list_equal(
+                state.valid_moves(), deepcopy(state).valid_moves())
+
+
+def test_iter_moves_is_lazy():
+    moves = example_state_1.iter_moves()
+    assert_equal(next(moves), example_state_1.valid_moves()[0])
+
+
+def test_uncover_first():
+    for state in random_playout(example_state_1, 4, 100):
+        moves = list(uncover_first(state))
+        assert_set_equal(set(moves), set(state.valid_moves()))
+        uncovering = [uncovers_card(state, move) for move in moves]
+        assert_list_equal(uncovering, sorted(uncovering, reverse=True))
+
+
+def test_learned_ordering():
+    ordering = LearnedOrdering()
+    state = endgame_state(0, 8)
+    ordering.train(state, solve(state).moves)
+    assert_true(
+        ordering.score(("MoveTableauToFoundation", False))
+        > ordering.score(("MoveFoundationToTableau", False)))
+
+    for state in random_playout(example_state_1, 5, 50):
+        assert_set_equal(set(ordering(state)), set(state.valid_moves()))
+
+
+def test_safe_for_foundation():
+    assert_true(safe_for_foundation(Card(0, 0), [0, 0, 0, 0]))
+    assert_true(safe_for_foundation(Card(1, 1), [0, 1, 0, 0]))
+    # 5♦ (rank 4) needs both black 4s up, and the 3♥
+    assert_false(safe_for_foundation(Card(4, 1), [4, 4, 3, 2]))
+    assert_false(safe_for_foundation(Card(4, 1), [3, 4, 4, 3]))
+    assert_true(safe_for_foundation(Card(4, 1), [4, 4, 4, 3]))
+
+
+def test_pruned_moves_plays_safe_card():
+    state = GameState(DECK)
+    state.tableau = [[[], []] for _ in range(7)]
+    state.tableau[2][1].append(Card(0, 2))
+    state.tableau[3][1].append(Card(12, 0))
+    assert_list_equal(list(pruned_moves(state)), [MoveTableauToFoundation(2)])
+
+
+def test_pruned_moves_drops_useless_moves():
+    # K♠ alone in a column, and 2♥ could come down onto 3♠ but it's safe
+    state = GameState(DECK)
+    state.tableau = [[[], []] for _ in range(7)]
+    state.tableau[0][1].append(Card(12, 0))
+    state.tableau[1][1].append(Card(2, 0))
+    state.foundation = [1, 2, 2, 2]
+    moves = list(pruned_moves(state))
+    assert_true(MoveTableauToTableau(0, 0, 2) in state.valid_moves())
+    assert_false(MoveTableauToTableau(0, 0, 2) in moves)
+    assert_true(MoveFoundationToTableau(3, 1) in state.valid_moves())
+    assert_false(MoveFoundationToTableau(3, 1) in moves)
+    assert_true(TurnStock() in moves)
+
+
+def test_solve_with_and_without_pruning():
+    for seed in range(5):
+        state = endgame_state(seed, 7)
+        pruned = solve(state)
+        assert_equal(pruned.status, solve(state, prune=False).status)
+        assert_true(play(state, pruned.moves).is_won())
+    assert_equal(solve(stuck_state(), prune=False).status, LOST)
+
+
+def test_macro_moves_from_stock():
+    state = GameState(DECK)
+    state.tableau = [[[], []] for _ in range(7)]
+    state.stock = [Card(rank, 0) for rank in range(7)]
+    state.waste = []
+    state.foundation = [0, 13, 13, 13]
+    # A♠ is at the bottom of the stock: 7 cards means 3 turns to reach it
+    macros = [
+        move for move in state.valid_moves(macros=True)
+        if isinstance(move, MoveFromStock)]
+    assert_true(MoveFromStock(3, MoveWasteToFoundation()) in macros)
+    assert_false(TurnStock() in state.valid_moves(macros=True))
+
+    # turning 3 at a time only ever gets to the 3rd, 6th and 7th cards
+    assert_list_equal(
+        [(turns, card.rank) for turns, card in state._turned_cards()],
+        [(1, 4), (2, 1), (3, 0)])
+
+
+def test_macro_move_expands():
+    state = endgame_state(1, 6)
+    for move in state.valid_moves(macros=True):
+        if isinstance(move, MoveFromStock):
+            expanded = move.expand()
+            assert_equal(len(expanded), move.turns + 1)
+            assert_equal(state.apply_move(move), play(state, expanded))
+
+
+def test_solve_with_macros():
+    for seed in range(5):
+        state = endgame_state(seed, 5)
+        result = solve(state, macros=True)
+        assert_equal(result.status, WON)
+        assert_false(
+            any(isinstance(move, MoveFromStock) for move in result.moves))
+        assert_true(play(state, result.moves).is_won())
+    assert_equal(solve(stuck_state(), macros=True).status, LOST)
+
+
+def test_solve_with_ordering():
+    for ordering in [foundation_first, uncover_first, LearnedOrdering()]:
+        for seed in range(3):
+            state = endgame_state(seed, 6)
+            result = solve(state, ordering=ordering)
+            assert_equal(result.status, WON)
+            assert_true(play(state, result.moves).is_won())
+        assert_equal(solve(stuck_state(), ordering=ordering).status, LOST)
+
+
+def test_rules_draw_one():
+    state = GameState(DECK, Rules(draw=1))
+    new_state = state.turn_stock()
+    assert_list_equal(new_state.waste, state.stock[-1:])
+    assert_list_equal(new_state.stock, state.stock[:-1])
+
+
+def test_rules_redeal_limit():
+    state = GameState(DECK, Rules(redeals=1))
+    for _ in range(8):
+        state = state.turn_stock()
+    assert_equal(len(state.stock), 0)
+    assert_true(TurnStock() in state.valid_moves())
+
+    redealt = state.turn_stock()
+    assert_equal(redealt.redeals, 1)
+    for _ in range(7):
+        redealt = redealt.turn_stock()
+    assert_false(TurnStock() in redealt.valid_moves())
+    assert_raises(InvalidMove, redealt.turn_stock)
+
+    # the same cards in the same places, but one fewer redeal left
+    assert_not_equal(redealt.key(), state.key())
+    assert_not_equal(redealt.zobrist(), state.zobrist())
+
+
+def test_rules_no_foundation_to_tableau():
+    # Q♦ could come down onto K♠
+    state = GameState(DECK)
+    state.tableau = [[[], []] for _ in range(7)]
+    state.tableau[0][1].append(Card(12, 0))
+    state.foundation = [0, 12, 0, 0]
+    assert_true(MoveFoundationToTableau(1, 0) in state.valid_moves())
+
+    state.rules = Rules(foundation_to_tableau=False)
+    assert_false(MoveFoundationToTableau(1, 0) in state.valid_moves())
+    assert_raises(InvalidMove, state.move_foundation_to_tableau, 1, 0)
+
+
+def test_rules_pack_and_hash():
+    rules = Rules(draw=1, redeals=2)
+    for seed in range(3):
+        state = deal_random_game(Random(seed), rules)
+        for state in random_playout(state, seed, 200):
+            packed = state.pack()
+            assert_equal(GameState.unpack(packed, rules).pack(), packed)
+            assert_equal(state.zobrist(), deepcopy(state).zobrist())
+
+
+def test_solve_with_rules():
+    for rules in [Rules(draw=1), Rules(draw=1, redeals=0)]:
+        for seed in range(3):
+            state = endgame_state(seed, 6)
+            state.rules = rules
+            for macros in [False, True]:
+                result = solve(state, macros=macros)
+                if result.status == WON:
+                    assert_true(play(state, result.moves).is_won())
+                else:
+                    assert_equal(result.status, LOST)
+
+
+def test_zobrist_tableau_column_order():
+    for state in random_playout(example_state_1, 3, 50):
+        swapped = deepcopy(state)
+        swapped.tableau.reverse()
+        assert_equal(swapped.zobrist(), state.zobrist())
 
 
 def test_card_less_than_lt():
@@ -803,3 +1244,637 @@ def test_card_greater_than_lt():
     for smaller_index, smaller in enumerate(DECK):
         for larger in DECK[smaller_index+1:]:
             assert_false(larger < smaller)
+
+
+def test_solve_endgame():
+    state = endgame_state(0, 8)
+    result = solve(state)
+    assert_equal(result.status, WON)
+    assert_true(play(state, result.moves).is_won())
+
+
+def test_solve_already_won():
+    state = GameState(DECK)
+    state.foundation = [13, 13, 13, 13]
+    assert_list_equal(solve(state).moves, [])
+
+
+def test_depth_first_search_is_resumable():
+    state = endgame_state(1, 8)
+    search = DepthFirstSearch(state)
+
+    assert_false(search.run(max_nodes=10))
+    assert_false(search.finished)
+    assert_equal(search.nodes, 10)
+
+    while not search.run(max_nodes=10):
+        pass
+
+    assert_true(search.finished)
+    assert_list_equal(search.solution, solve(state).moves)
+
+
+def stuck_state():
+    """
+    Every heart is stuck behind the King of Hearts, and the cards in the
+    stock just go round and round.
+    """
+    state = GameState(DECK)
+    state.foundation = [13, 13, 13, 0]
+    state.tableau = [[[Card(0, 3)], [Card(12, 3)]]]
+    state.tableau.extend([[], [Card(rank, 3)]] for rank in range(6, 12))
+    state.stock = [Card(rank, 3) for rank in range(1, 6)]
+    state.waste = []
+    return state
+
+
+def test_transposition_table_reused():
+    state = endgame_state(0, 8)
+    table = TranspositionTable()
+    solution = solve(state, table=table).moves
+
+    search = DepthFirstSearch(state, table=table)
+    assert_true(search.finished)
+    assert_equal(search.tt_hits, 1)
+    assert_list_equal(search.solution, solution)
+
+
+def test_transposition_table_reused_with_columns_reordered():
+    for seed in range(10):
+        state = endgame_state(seed, 8)
+        table = TranspositionTable()
+        solve(state, table=table)
+
+        reordered = deepcopy(state)
+        reordered.tableau.reverse()
+        result = solve(reordered, table=table)
+        assert_equal(result.status, WON)
+        assert_true(play(reordered, result.moves).is_won())
+
+
+def test_transposition_table_lost_states_are_lost():
+    state = endgame_state(2, 8)
+    table = TranspositionTable()
+    solve(state, table=table)
+
+    lost = [key for key, entry in table.entries.items() if entry[0] == LOST]
+    assert_true(len(lost) > 0)
+    for key in lost[:5]:
+        assert_equal(solve(GameState.unpack(key)).status, LOST)
+
+
+def test_transposition_table_records_loss_only_when_proven():
+    state = stuck_state()
+    table = TranspositionTable()
+    search = DepthFirstSearch(state, table=table)
+
+    # the first state visited can get back to the state above it, so we
+    # don't know it's lost yet
+    assert_false(search.run(max_nodes=1))
+    assert_equal(len(table), 0)
+
+    assert_true(search.run())
+    assert_is_none(search.solution)
+    assert_equal(table.lookup(state), (LOST, None))
+    assert_equal(len(table), 3)
+
+
+def test_transposition_table_evicts_least_recently_used():
+    states = random_playout(example_state_1, 0, 2)
+    table = TranspositionTable(max_entries=2)
+    table.store_lost(states[0])
+    table.store_lost(states[1])
+    table.lookup(states[0])
+    table.store_lost(states[2])
+
+    assert_equal(len(table), 2)
+    assert_equal(table.evictions, 1)
+    assert_is_none(table.lookup(states[1]))
+    assert_equal(table.lookup(states[0]), (LOST, None))
+
+
+def test_deck_to_string_and_back():
+    deck = list(DECK)
+    Random(0).shuffle(deck)
+    assert_list_equal(deck_from_string(deck_to_string(deck)), deck)
+
+
+def test_deck_from_string_needs_every_card():
+    with assert_raises(ValueError):
+        deck_from_string(" ".join(["0"] * 52))
+
+    with assert_raises(ValueError):
+        deck_from_string("0 1 2")
+
+
+def test_batch_solve_deal_node_budget():
+    deck = deck_to_string(next(batch.seeded_deals(1))[1])
+    result = batch.solve_deal((7, deck, 50, None, None))
+    assert_equal(result["deal"], 7)
+    assert_equal(result["result"], "unknown")
+    assert_equal(result["nodes"], 50)
+
+
+def test_move_lists():
+    moves = [
+        TurnStock(), MoveTableauToTableau(3, 1, 5), MoveTableauToFoundation(2),
+        MoveWasteToTableau(6), MoveWasteToFoundation(),
+        MoveFoundationToTableau(1, 4)]
+    lists = [move_to_list(move) for move in moves]
+    assert_list_equal(lists[1], ["MoveTableauToTableau", 3, 1, 5])
+    assert_list_equal([move_from_list(move) for move in lists], moves)
+    assert_raises(ValueError, move_from_list, ["Shuffle"])
+
+
+def test_batch_solve_deals():
+    deals = list(batch.seeded_deals(4, seed=1))
+    results = list(batch.solve_deals(deals, processes=2, max_nodes=200))
+    assert_equal(sorted(result["deal"] for result in results), [0, 1, 2, 3])
+    for result in results:
+        if result["result"] == "won":
+            state = GameState(deals[result["deal"]][1])
+            moves = [move_from_list(move) for move in result["moves"]]
+            assert_true(play(state, moves).is_won())
+
+
+def test_solution_database():
+    deck = next(batch.seeded_deals(1, seed=2))[1]
+    state = GameState(deck)
+    won = solve(state)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "solutions.db")
+        with solution_db.SolutionDatabase(path, batch_size=2) as database:
+            assert_is_none(database.lookup(deck))
+            database.store(deck, won)
+            # a later search that gave up doesn't make it forget the win
+            database.store(state, SolveResult(UNKNOWN, None, "nodes"))
+            assert_equal(database.lookup(state).status, WON)
+            assert_is_none(database.lookup(deck, Rules(draw=1)))
+
+        with solution_db.SolutionDatabase(path) as database:
+            assert_equal(len(database), 1)
+            result = database.lookup(deck)
+            database.store(deck, SolveResult(UNKNOWN, None, "nodes"))
+        with solution_db.SolutionDatabase(path) as database:
+            assert_equal(database.lookup(state).status, WON)
+
+    assert_equal(result.moves, won.moves)
+    assert_equal(result.stats, won.stats)
+
+
+def test_batch_solve_deals_with_database():
+    deals = list(batch.seeded_deals(4, seed=1))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "solutions.db")
+        with solution_db.SolutionDatabase(path) as database:
+            first = list(batch.solve_deals(
+                deals, processes=2, max_nodes=20000, database=database))
+            again = list(batch.solve_deals(
+                deals, processes=2, max_nodes=20000, database=database))
+
+    known = [result for result in first if result["result"] != UNKNOWN]
+    assert_true(known)
+    cached = [result for result in again if result.get("cached")]
+    assert_equal(
+        sorted(result["deal"] for result in cached),
+        sorted(result["deal"] for result in known))
+    assert_equal(len(again), len(deals))
+
+
+def test_batch_solve_deals_memory_budget():
+    deals = list(batch.seeded_deals(3, seed=1))
+    max_memory = memory_in_use() + 200 * 1024 * 1024
+    results = list(batch.solve_deals(
+        deals, processes=1, max_nodes=2000, max_memory=max_memory))
+    assert_equal(len(results), 3)
+    for result in results:
+        assert_not_equal(result["exhausted"], "memory")
+
+
+def test_solve_lost():
+    result = solve(stuck_state())
+    assert_equal(result.status, LOST)
+    assert_is_none(result.moves)
+    assert_is_none(result.exhausted)
+
+
+def test_solve_lost_with_fingerprint_set():
+    # every state that got skipped was further up the path, so it's a proof
+    # even if fingerprints could have collided
+    result = solve(stuck_state(), visited=FingerprintSet())
+    assert_equal(result.status, LOST)
+
+
+def test_solve_node_budget():
+    result = solve(deal_random_game(Random(0)), max_nodes=100)
+    assert_equal(result.status, UNKNOWN)
+    assert_equal(result.exhausted, "nodes")
+    assert_equal(result.stats["nodes"], 100)
+
+
+def test_solve_time_budget():
+    result = solve(deal_random_game(Random(0)), max_seconds=0)
+    assert_equal(result.status, UNKNOWN)
+    assert_equal(result.exhausted, "seconds")
+
+
+def test_solve_memory_budget():
+    result = solve(deal_random_game(Random(0)), max_memory=1)
+    assert_equal(result.status, UNKNOWN)
+    assert_equal(result.exhausted, "memory")
+
+
+def test_solve_progress_hook():
+    samples = []
+    result = solve(
+        deal_random_game(Random(0)), max_nodes=1000, progress=samples.append,
+        sample_interval=100)
+
+    assert_list_equal(
+        [stats.nodes for stats in samples], list(range(100, 1001, 100)))
+    for stats in samples:
+        assert_true(0 < stats.depth <= stats.max_depth <= stats.nodes)
+        assert_true(stats.branching_factor > 1)
+
+    assert_equal(result.stats["max_depth"], samples[-1].max_depth)
+    assert_equal(result.stats["branching_factor"], samples[-1].branching_factor)
+
+
+def test_deal_random_game_with_rng():
+    state1 = deal_random_game(Random(5))
+    state2 = deal_random_game(Random(5))
+    assert_equal(state1.pack(), state2.pack())
+    assert_not_equal(state1.pack(), deal_random_game(Random(6)).pack())
+
+
+def test_benchmark_corpus():
+    deals = benchmark.load_corpus()
+    categories = set(deal["category"] for deal in deals)
+    assert_set_equal(categories, set(["easy", "medium", "hard", "unsolvable"]))
+    for deal in deals:
+        deck_from_string(deal["deck"])
+
+
+def test_benchmark_run_deal():
+    deals = benchmark.load_corpus()
+    for deal in deals:
+        if deal["category"] in ("easy", "unsolvable"):
+            result = benchmark.run_deal((deal, None, None))
+            assert_equal(result["result"], deal["expected"])
+
+
+def test_benchmark_compare():
+    old = {
+        "valid_moves_per_second": 1000, "apply_move_per_second": 1000,
+        "deals": [
+            {"name": "a", "expected": WON, "result": WON, "seconds": 1.0},
+            {"name": "b", "expected": WON, "result": WON, "seconds": 1.0},
+        ],
+    }
+    new = {
+        "valid_moves_per_second": 500, "apply_move_per_second": 1000,
+        "deals": [
+            {"name": "a", "expected": WON, "result": WON, "seconds": 2.0},
+            {"name": "b", "expected": WON, "result": LOST, "seconds": 1.0},
+        ],
+    }
+    assert_list_equal(benchmark.compare(old, old), [])
+    assert_equal(len(benchmark.compare(old, new)), 3)
+
+
+def shortest_solution_length(state):
+    """
+    Breadth-first search, to check A* against.
+    """
+    seen = set([state.key()])
+    layer = [state]
+    length = 0
+    while layer:
+        next_layer = []
+        for state in layer:
+            if state.is_won():
+                return length
+            for move in state.valid_moves():
+                new_state = state.apply_move(move)
+                if new_state.key() not in seen:
+                    seen.add(new_state.key())
+                    next_layer.append(new_state)
+        layer = next_layer
+        length += 1
+
+
+def test_minimum_moves_left():
+    state = GameState(DECK)
+    assert_equal(minimum_moves_left(state), 53)
+    state.stock[:] = []
+    assert_equal(minimum_moves_left(state), 52)
+
+
+def test_estimated_moves_left():
+    # 4 cards left, 3 of them face down, and Q♠ is blocked by being on J♠
+    state = GameState(DECK)
+    state.tableau = [[[], []] for _ in range(7)]
+    state.tableau[0] = [
+        [Card(12, 0), Card(10, 0), Card(11, 0)], [Card(9, 0)]]
+    state.stock = []
+    state.foundation = [9, 13, 13, 13]
+    assert_equal(estimated_moves_left(state), 4 + 3 + 1)
+
+
+def test_best_first_search():
+    for seed in range(5):
+        state = endgame_state(seed, 6)
+        result = solve(state, strategy=BEST_FIRST)
+        assert_equal(result.status, WON)
+        assert_true(play(state, result.moves).is_won())
+
+
+def test_a_star_finds_shortest_solution():
+    for seed in range(2):
+        state = endgame_state(seed, 12)
+        result = solve(state, strategy=A_STAR)
+        assert_equal(result.status, WON)
+        assert_true(play(state, result.moves).is_won())
+        assert_equal(len(result.moves), shortest_solution_length(state))
+        assert_true(len(result.moves) <= len(solve(state).moves))
+
+
+def test_best_first_search_lost():
+    for strategy in [BEST_FIRST, A_STAR]:
+        result = solve(stuck_state(), strategy=strategy)
+        assert_equal(result.status, LOST)
+
+
+def test_best_first_search_resumable():
+    state = endgame_state(3, 6)
+    search = BestFirstSearch(state)
+    while not search.run(max_nodes=5):
+        assert_false(search.finished)
+    assert_true(play(state, search.solution).is_won())
+
+
+def test_best_first_search_reuses_table():
+    state = endgame_state(1, 6)
+    table = TranspositionTable()
+    solve(state, table=table)
+    result = solve(state, table=table, strategy=BEST_FIRST)
+    assert_equal(result.status, WON)
+    assert_true(result.stats["tt_hits"] > 0)
+    assert_true(play(state, result.moves).is_won())
+
+
+def test_beam_search():
+    for seed in range(3):
+        state = endgame_state(seed, 6)
+        for macros in [False, True]:
+            result = solve(
+                state, strategy=BEAM, beam_width=20, macros=macros)
+            assert_equal(result.status, WON)
+            assert_true(play(state, result.moves).is_won())
+
+
+def test_beam_search_lost():
+    result = solve(stuck_state(), strategy=BEAM)
+    assert_equal(result.status, LOST)
+
+
+def test_narrow_beam_escalates():
+    state = endgame_state(4, 4)
+    result = solve(state, strategy=BEAM, beam_width=1)
+    assert_equal(result.status, UNKNOWN)
+    assert_equal(result.exhausted, "beam")
+
+    result = solve(state, strategy=BEAM, beam_width=1, escalate=True)
+    assert_equal(result.status, WON)
+    assert_true(result.stats["beam_nodes"] > 0)
+    assert_true(play(state, result.moves).is_won())
+
+
+def test_beam_search_resumable():
+    state = endgame_state(3, 6)
+    search = BeamSearch(state, width=10)
+    while not search.run(max_nodes=5):
+        assert_false(search.finished)
+    assert_true(play(state, search.solution).is_won())
+
+
+def test_solver_hints_reuse_search():
+    for accelerate in [True, False]:
+        state = endgame_state(2, 5)
+        solver = Solver(accelerate=accelerate)
+        move = solver.hint(state)
+        entries = len(solver.table)
+        while not state.is_won():
+            state = state.apply_move(move)
+            move = solver.hint(state)
+        # every hint after the first came out of the table
+        assert_equal(len(solver.table), entries)
+
+
+def test_solver_hint_with_columns_reordered():
+    state = endgame_state(6, 6)
+    solver = Solver()
+    solver.hint(state)
+    reordered = deepcopy(state)
+    reordered.tableau.reverse()
+    assert_in(solver.hint(reordered), reordered.valid_moves())
+    assert_true(play(reordered, solver.solve(reordered).moves).is_won())
+
+
+def test_solver_resumes_search():
+    state = endgame_state(0, 5)
+    solver = Solver(max_nodes=10, accelerate=False)
+    results = [solver.solve(state)]
+    while results[-1].status == UNKNOWN:
+        assert_true(solver.search is not None)
+        results.append(solver.solve(state))
+    assert_true(len(results) > 1)
+    assert_equal(results[-1].status, WON)
+    assert_true(play(state, results[-1].moves).is_won())
+
+
+def test_solver_lost():
+    solver = Solver()
+    assert_is_none(solver.hint(stuck_state()))
+    assert_equal(solver.table.lookup(stuck_state()), (LOST, None))
+
+
+def test_solve_unknown_strategy():
+    assert_raises(ValueError, solve, GameState(DECK), strategy="sideways")
+
+
+def test_accel_matches_python():
+    if not accel.available:
+        raise SkipTest("no C compiler")
+    for rules in [DEFAULT_RULES, Rules(draw=1, redeals=2), Rules(
+            foundation_to_tableau=False)]:
+        for seed in range(3):
+            state = deal_random_game(Random(seed), rules)
+            for state in random_playout(state, seed, 150):
+                assert_equal(accel.key(state), state.key())
+                moves = state.valid_moves()
+                assert_list_equal(accel.valid_moves(state), moves)
+                assert_list_equal(
+                    accel.valid_moves(state, prune=True),
+                    list(pruned_moves(state)))
+                for move in moves:
+                    assert_equal(
+                        accel.apply_move(state, move).pack(),
+                        state.apply_move(move).pack())
+
+
+def test_accel_solve_finds_same_solution():
+    if not accel.available:
+        raise SkipTest("no C compiler")
+    states = [endgame_state(seed, 5) for seed in range(5)]
+    states += [stuck_state(), deal_random_game(Random(1), Rules(draw=1))]
+    for state in states:
+        for prune in [True, False]:
+            fast = solve(state, prune=prune, max_nodes=5000)
+            slow = solve(state, prune=prune, max_nodes=5000, accelerate=False)
+            assert_equal(fast.status, slow.status)
+            assert_equal(fast.moves, slow.moves)
+            assert_equal(fast.stats["nodes"], slow.stats["nodes"])
+
+
+def test_parallel_solve():
+    for seed in range(3):
+        state = endgame_state(seed, 5)
+        result = solve(state, processes=2)
+        assert_equal(result.status, WON)
+        assert_true(play(state, result.moves).is_won())
+
+
+def test_parallel_solve_steals_work():
+    state = endgame_state(3, 4)
+    result = parallel.parallel_solve(
+        state, processes=2, first_tasks=1, chunk_nodes=20)
+    assert_equal(result.status, WON)
+    assert_true(result.stats["steals"] > 0)
+    assert_true(play(state, result.moves).is_won())
+
+
+def test_parallel_solve_lost():
+    deal = [
+        deal for deal in benchmark.load_corpus()
+        if deal["name"] == "unsolvable-2"][0]
+    state = GameState(deck_from_string(deal["deck"]))
+    result = parallel.parallel_solve(
+        state, processes=2, first_tasks=1, chunk_nodes=50)
+    assert_equal(result.status, LOST)
+    assert_true(result.stats["steals"] > 0)
+
+
+def _broken_ordering(game_state, macros=False):
+    raise RuntimeError("broken")
+
+
+def test_parallel_solve_worker_fails():
+    # with one first task, the ordering only gets used in the workers
+    with assert_raises(RuntimeError):
+        parallel.parallel_solve(
+            endgame_state(0, 5), processes=2, ordering=_broken_ordering,
+            first_tasks=1)
+
+
+def test_solve_with_processes_bad_arguments():
+    state = endgame_state(0, 5)
+    with assert_raises(ValueError):
+        solve(state, processes=2, strategy=BEST_FIRST)
+    with assert_raises(ValueError):
+        solve(state, processes=2, visited=set())
+    with assert_raises(ValueError):
+        solve(state, processes=2, table=TranspositionTable())
+    with assert_raises(ValueError):
+        solve(state, processes=2, max_memory=1 << 30)
+
+def _shared_table_child(table, state, lost, results):
+    results.put((table.lookup(state), table.lookup(lost)))
+    table.store_lost(state.apply_move(TurnStock()))
+    table.close()
+
+
+def test_shared_transposition_table():
+    from multiprocessing import Process, Queue
+
+    state = endgame_state(4, 8)
+    table = parallel.SharedTranspositionTable(capacity=1024, stripes=4)
+    result = solve(state, table=table)
+    assert_equal(result.status, WON)
+    assert_true(len(table) > 0)
+    assert_list_equal(table.solution(state), result.moves)
+
+    reordered = deepcopy(state)
+    reordered.tableau.reverse()
+    assert_true(play(reordered, table.solution(reordered)).is_won())
+
+    # another process sees the same table, and can add to it
+    table.store_lost(stuck_state())
+    results = Queue()
+    child = Process(
+        target=_shared_table_child,
+        args=(table, state, stuck_state(), results))
+    child.start()
+    won, lost = results.get()
+    child.join()
+    assert_equal(won, (WON, result.moves[0]))
+    assert_equal(lost, (LOST, None))
+    assert_equal(table.lookup(state.apply_move(TurnStock())), (LOST, None))
+
+    table.close()
+    table.unlink()
+
+
+def test_shared_transposition_table_full():
+    table = parallel.SharedTranspositionTable(
+        capacity=8, max_probes=2, stripes=2)
+    keys = [bytes([number]) * 10 for number in range(40)]
+    for key in keys:
+        table.store_lost_key(key)
+    assert_equal(len(table), 8)
+    assert_true(table.evictions > 0)
+    table.close()
+    table.unlink()
+
+
+def test_parallel_solve_shares_table():
+    table = parallel.SharedTranspositionTable()
+    state = endgame_state(2, 5)
+    first = parallel.parallel_solve(state, processes=2, table=table)
+    again = parallel.parallel_solve(state, processes=2, table=table)
+    assert_equal(first.status, WON)
+    assert_equal(again.status, WON)
+    assert_true(again.stats["nodes"] <= first.stats["nodes"])
+    assert_true(play(state, again.moves).is_won())
+    table.close()
+    table.unlink()
+
+
+def test_shared_transposition_table_uneven_capacity():
+    # 1000 doesn't split evenly into 64 stripes, so it gets rounded up
+    table = parallel.SharedTranspositionTable(capacity=1000)
+    assert_true(
+        table.memory.size >= table.capacity * table.ENTRY.size)
+    keys = [str(number).encode() for number in range(5000)]
+    for key in keys:
+        table.store_lost_key(key)
+    assert_equal(len(table), table.capacity)
+    assert_equal(
+        sum(table._get(key) is not None for key in keys), table.capacity)
+    table.close()
+    table.unlink()
+
+
+def test_parallel_solve_racing_on_table():
+    # with a table this small, wins keep getting evicted and stored again
+    # by other workers while they're being followed
+    table = parallel.SharedTranspositionTable(
+        capacity=512, max_probes=2, stripes=4)
+    for seed in [0, 2, 3, 4, 5]:
+        state = endgame_state(seed, 4)
+        result = parallel.parallel_solve(
+            state, processes=4, table=table, max_seconds=60)
+        assert_equal(result.status, WON)
+        assert_true(play(state, result.moves).is_won())
+    table.close()
+    table.unlink()